@@ -1,32 +1,130 @@
 #!/usr/bin/env python3
-import requests
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils import get_session, memoize
+
+
+_LINK_RE = re.compile(r'<([^>]*)>\s*;\s*rel="?([^";]+)"?')
+
+
+def parse_link_header(header):
+    """Return {rel: url} from an HTTP Link header ('' or None gives {})."""
+    if not isinstance(header, str):
+        return {}
+    links = {}
+    for url, rels in _LINK_RE.findall(header):
+        for rel in rels.split():
+            links[rel] = url
+    return links
+
+
+def page_number(url):
+    """Return the integer `page` query parameter of `url`, or None."""
+    for name, value in parse_qsl(urlsplit(url).query):
+        if name == 'page' and value.isdigit():
+            return int(value)
+    return None
+
+
+def with_page(url, page):
+    """Return `url` with its `page` query parameter set to `page`."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
 
 class GithubOrgClient:
-    """Simple client to fetch Github organization info."""
+    """Simple client to fetch Github organization info.
 
-    def __init__(self, org_name):
+    Pass a response_cache.ResponseCache as `cache` to serve requests from
+    an on-disk cache shared across instances, processes and restarts.
+    """
+    ORG_URL = "https://api.github.com/orgs/{org}"
+
+    def __init__(self, org_name, max_workers=8, cache=None):
         self.org_name = org_name
+        self.max_workers = max_workers
+        self.cache = cache
+
+    def _get(self, url):
+        # The shared session's keep-alive pool is reused by every page fetch
+        if self.cache is None:
+            return get_session().get(url)
+        return self.cache.get(url)
 
+    def _get_json(self, url):
+        return self._get(url).json()
+
+    @memoize
     def org(self):
-        url = f"https://api.github.com/orgs/{self.org_name}"
-        return requests.get(url).json()
+        url = self.ORG_URL.format(org=self.org_name)
+        return self._get_json(url)
 
     @property
     def _public_repos_url(self):
         data = self.org()
         return data.get('repos_url')
 
-    def public_repos(self, license=None):
+    def repo_pages(self):
+        """Yield the repos payload one page at a time, in page order.
+
+        The first page's Link header tells how many pages there are
+        (rel="last"); the remaining ones are then fetched concurrently on
+        up to `max_workers` threads, with at most twice that many pages
+        buffered ahead of the consumer. Without a rel="last" link the
+        rel="next" links are followed one by one.
+        """
         repos_url = self._public_repos_url
         # If the attribute was patched with a Mock (callable), call it
         if callable(repos_url):
             repos_url = repos_url()
-        repos = requests.get(repos_url).json()
-        names = [r.get('name') for r in repos]
-        if license:
-            names = [r.get('name') for r in repos if r.get('license') and r.get('license').get('key') == license]
-        return names
+        resp = self._get(repos_url)
+        yield resp.json()
+
+        links = parse_link_header(getattr(resp, 'headers', {}).get('Link'))
+        last = page_number(links['last']) if 'last' in links else None
+        if last is None:
+            while 'next' in links:
+                resp = self._get(links['next'])
+                yield resp.json()
+                links = parse_link_header(resp.headers.get('Link'))
+            return
+
+        first = page_number(links.get('next', '')) or 2
+        urls = (with_page(links['last'], page)
+                for page in range(first, last + 1))
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            try:
+                for url in urls:
+                    window.append(pool.submit(self._get_json, url))
+                    if len(window) >= 2 * self.max_workers:
+                        yield window.popleft().result()
+                while window:
+                    yield window.popleft().result()
+            finally:
+                # Consumer stopped early: don't fetch pages nobody will read
+                for future in window:
+                    future.cancel()
+
+    def iter_public_repos(self, license=None):
+        """Yield repo names page by page as they arrive (see repo_pages)."""
+        for page in self.repo_pages():
+            for repo in page:
+                if license is None or self.has_license(repo, license):
+                    yield repo.get('name')
+
+    def public_repos(self, license=None, stream=False):
+        """Return the names of all the org's repos, across every page,
+        optionally only those under `license`. With stream=True return
+        an iterator instead of a list.
+        """
+        names = self.iter_public_repos(license)
+        return names if stream else list(names)
 
     @staticmethod
     def has_license(repo, license_key):
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from utils import get_session
+
+
+# Fresh hits only note their access time in memory; the times are written
+# with the next store or eviction, or once this many have piled up.
+TOUCH_BATCH = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    link TEXT,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS responses_fetched ON responses (fetched_at);
+"""
+
+
+def cache_directives(header):
+    """Return the directives of a Cache-Control header as a dict of
+    lowercased name -> value (None for directives without one).
+    """
+    directives = {}
+    for part in (header or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+class CachedResponse:
+    """The parts of a requests.Response the client uses, rebuilt from a
+    cache row. `source` is 'fresh', 'revalidated', 'network' or 'stale'.
+    """
+    def __init__(self, url, body, etag, last_modified, link, source):
+        self.url = url
+        self.content = body
+        self.status_code = 200
+        self.headers = {}
+        if etag:
+            self.headers['ETag'] = etag
+        if last_modified:
+            self.headers['Last-Modified'] = last_modified
+        if link:
+            self.headers['Link'] = link
+        self.source = source
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """On-disk HTTP response cache keyed by URL, shared by every thread and
+    process that opens the same SQLite file (WAL mode, so readers never
+    wait on a writer). Requests go through utils.get_session().
+
+    Fresh entries are served without a request: they stay fresh for the
+    response's Cache-Control max-age, or `ttl` seconds without one.
+    Responses marked no-store are not kept and no-cache ones are
+    revalidated on every use. Expired entries are revalidated with
+    If-None-Match / If-Modified-Since, and a 304 refreshes them without a
+    new body. If the network fails or the server answers 5xx, the stale
+    entry is served instead, so jobs keep working offline.
+
+    Eviction runs with each store. It drops entries fetched more than
+    `max_age` seconds ago. It then drops the least recently used ones
+    until at most `max_entries` rows and `max_bytes` of bodies remain.
+    Each limit is optional.
+    """
+    def __init__(self, path='github_cache.db', ttl=300, max_entries=None,
+                 max_bytes=None, max_age=None, timeout=10):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        self._local = threading.local()
+        self._conns = []
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._stats = {'fresh': 0, 'revalidated': 0, 'network': 0,
+                       'stale': 0, 'evicted': 0}
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        # One connection per thread: client pages are fetched concurrently
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self, conn):
+        # Take the write lock up front, so concurrent writers queue on the
+        # busy timeout instead of failing to upgrade a read transaction
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            with self._lock:
+                touched, self._touched = self._touched, {}
+            if touched:
+                conn.executemany(
+                    'UPDATE responses SET accessed_at = max(accessed_at, ?) '
+                    'WHERE url = ?',
+                    [(when, url) for url, when in touched.items()])
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def _touch(self, url, when):
+        with self._lock:
+            self._touched[url] = when
+            flush = len(self._touched) >= TOUCH_BATCH
+        if flush:
+            with self._transaction(self._connection()):
+                pass
+
+    def _count(self, outcome, n=1):
+        with self._lock:
+            self._stats[outcome] += n
+
+    def _lifetime(self, resp):
+        """Seconds `resp` stays fresh, or None if it must not be stored."""
+        directives = cache_directives(resp.headers.get('Cache-Control'))
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0
+        max_age = directives.get('max-age')
+        return int(max_age) if max_age and max_age.isdigit() else self.ttl
+
+    def get(self, url):
+        """Return a CachedResponse for `url`, from the cache if possible."""
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT body, etag, last_modified, link, expires_at '
+            'FROM responses WHERE url = ?', (url,)).fetchone()
+        now = time.time()
+        if row is not None and row[4] > now:
+            self._touch(url, now)
+            self._count('fresh')
+            return CachedResponse(url, *row[:4], 'fresh')
+
+        headers = {}
+        if row is not None:
+            if row[1]:
+                headers['If-None-Match'] = row[1]
+            if row[2]:
+                headers['If-Modified-Since'] = row[2]
+        try:
+            resp = get_session().get(url, headers=headers,
+                                     timeout=self.timeout)
+        except requests.RequestException:
+            if row is None:
+                raise
+            self._count('stale')
+            return CachedResponse(url, *row[:4], 'stale')
+
+        lifetime = self._lifetime(resp)
+        if resp.status_code == 304 and row is not None:
+            with self._transaction(conn):
+                if lifetime is None:
+                    conn.execute('DELETE FROM responses WHERE url = ?',
+                                 (url,))
+                else:
+                    conn.execute(
+                        'UPDATE responses SET expires_at = ?, '
+                        'accessed_at = ? WHERE url = ?',
+                        (now + lifetime, now, url))
+            self._count('revalidated')
+            return CachedResponse(url, *row[:4], 'revalidated')
+        if resp.status_code >= 500 and row is not None:
+            self._count('stale')
+            return CachedResponse(url, *row[:4], 'stale')
+        resp.raise_for_status()
+
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        link = resp.headers.get('Link')
+        dropped = 0
+        if lifetime is None:
+            if row is not None:
+                with self._transaction(conn):
+                    conn.execute('DELETE FROM responses WHERE url = ?',
+                                 (url,))
+        else:
+            with self._transaction(conn):
+                conn.execute(
+                    'INSERT OR REPLACE INTO responses (url, body, etag, '
+                    'last_modified, link, size, fetched_at, expires_at, '
+                    'accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (url, resp.content, etag, last_modified, link,
+                     len(resp.content), now, now + lifetime, now))
+                dropped = self._evict(conn)
+        self._count('network')
+        self._count('evicted', dropped)
+        return CachedResponse(url, resp.content, etag, last_modified, link,
+                              'network')
+
+    def get_json(self, url):
+        return self.get(url).json()
+
+    def _evict(self, conn):
+        if self.max_age is None and self.max_entries is None and \
+                self.max_bytes is None:
+            return 0
+        dropped = 0
+        if self.max_age is not None:
+            dropped += conn.execute(
+                'DELETE FROM responses WHERE fetched_at < ?',
+                (time.time() - self.max_age,)).rowcount
+        count, size = conn.execute(
+            'SELECT count(*), coalesce(sum(size), 0) FROM responses'
+        ).fetchone()
+        over = count - self.max_entries if self.max_entries is not None else 0
+        max_bytes = self.max_bytes
+        if over <= 0 and (max_bytes is None or size <= max_bytes):
+            return dropped
+        victims = []
+        for url, entry_size in conn.execute(
+                'SELECT url, size FROM responses ORDER BY accessed_at'):
+            if over <= 0 and (max_bytes is None or size <= max_bytes):
+                break
+            victims.append((url,))
+            over -= 1
+            size -= entry_size
+        dropped += conn.executemany(
+            'DELETE FROM responses WHERE url = ?', victims).rowcount
+        return dropped
+
+    def evict(self):
+        """Apply the age, entry-count and size limits; return the number
+        of entries dropped.
+        """
+        with self._transaction(self._connection()) as conn:
+            dropped = self._evict(conn)
+        self._count('evicted', dropped)
+        return dropped
+
+    def clear(self):
+        with self._transaction(self._connection()) as conn:
+            conn.execute('DELETE FROM responses')
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['entries'], snapshot['bytes'] = self._connection().execute(
+            'SELECT count(*), coalesce(sum(size), 0) FROM responses'
+        ).fetchone()
+        return snapshot
+
+    def close(self):
+        if self._touched:
+            with self._transaction(self._connection()):
+                pass
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
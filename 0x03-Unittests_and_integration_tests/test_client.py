@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, Mock
-from client import GithubOrgClient
+from urllib.parse import parse_qs, urlsplit
+import requests
+from client import GithubOrgClient, parse_link_header, with_page
+from response_cache import ResponseCache
 import fixtures
 
 
 class TestGithubOrgClient(unittest.TestCase):
-	@patch('client.requests.get')
-	def test_org(self, mock_get):
+	@patch('client.get_session')
+	def test_org(self, mock_session):
+		mock_get = mock_session.return_value.get
 		# parametrize with a couple of org names
 		for org_name in ('google', 'abc'):
 			mock_get.return_value.json.return_value = {"login": org_name}
@@ -21,21 +31,23 @@ class TestGithubOrgClient(unittest.TestCase):
 			gh = GithubOrgClient('test')
 			self.assertEqual(gh._public_repos_url, payload['repos_url'])
 
-	@patch('client.requests.get')
-	def test_public_repos(self, mock_get):
-		# Mock the property to return a url, and mock requests.get to return repos
+	@patch('client.get_session')
+	def test_public_repos(self, mock_session):
+		# Mock the property to return a url, and mock the session's get to return repos
+		mock_get = mock_session.return_value.get
 		mock_get.return_value.json.return_value = fixtures.repos_payload
 		with patch.object(GithubOrgClient, '_public_repos_url', new_callable=Mock) as mock_prop:
 			mock_prop.return_value = 'https://api.github.com/orgs/test/repos'
 			gh = GithubOrgClient('test')
 			repos = gh.public_repos()
 			self.assertEqual(repos, fixtures.expected_repos)
-			# Ensure the patched property (mock) was accessed and requests.get called
+			# Ensure the patched property (mock) was accessed and the session's get called
 			mock_prop.assert_called()
 			mock_get.assert_called_once_with(mock_prop.return_value)
 
-	@patch('client.requests.get')
-	def test_public_repos_with_license(self, mock_get):
+	@patch('client.get_session')
+	def test_public_repos_with_license(self, mock_session):
+		mock_get = mock_session.return_value.get
 		# Test filtering by license key
 		mock_get.return_value.json.return_value = fixtures.repos_payload
 		with patch.object(GithubOrgClient, '_public_repos_url', new_callable=Mock) as mock_prop:
@@ -59,9 +71,9 @@ class TestGithubOrgClient(unittest.TestCase):
 class TestIntegrationGithubOrgClient(unittest.TestCase):
 	@classmethod
 	def setUpClass(cls):
-		# Patch requests.get so that .json() returns different payloads
-		cls.get_patcher = patch('client.requests.get')
-		mock_get = cls.get_patcher.start()
+		# Patch the session's get so that .json() returns different payloads
+		cls.get_patcher = patch('client.get_session')
+		mock_get = cls.get_patcher.start().return_value.get
 
 		def side_effect(url, *args, **kwargs):
 			m = Mock()
@@ -85,6 +97,305 @@ class TestIntegrationGithubOrgClient(unittest.TestCase):
 		self.assertEqual(repos_with_license, fixtures.apache2_repos)
 
 
+# fixtures.repos_payload scaled up to a large org, served PER_PAGE at a time
+SCALE = 70
+PER_PAGE = 10
+BIG_REPOS = [dict(repo, name=f"{repo['name']}-{i}")
+	for i in range(SCALE) for repo in fixtures.repos_payload]
+
+
+class _FakeGithub(BaseHTTPRequestHandler):
+	"""Stand-in for the GitHub API: /orgs/<org> and paginated
+	/orgs/<org>/repos with Link headers. With `with_last` False only
+	rel="next" links are sent. Responses carry an ETag and answer a
+	matching If-None-Match with 304; `cache_control` is sent as the
+	Cache-Control header and `status` replaces every response with that
+	error status.
+	"""
+	protocol_version = 'HTTP/1.1'
+	with_last = True
+	delay = 0.0
+	cache_control = None
+	status = None
+	lock = threading.Lock()
+	in_flight = 0
+	max_in_flight = 0
+	pages_served = []
+	paths_served = []
+	connections = set()
+	not_modified = 0
+
+	def do_GET(self):
+		cls = type(self)
+		with cls.lock:
+			cls.connections.add(self.client_address)
+			cls.in_flight += 1
+			cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+		try:
+			time.sleep(cls.delay)
+			self._respond()
+		finally:
+			with cls.lock:
+				cls.in_flight -= 1
+
+	def _respond(self):
+		cls = type(self)
+		cls.paths_served.append(self.path)
+		if cls.status is not None:
+			self.send_response(cls.status)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		parts = urlsplit(self.path)
+		base = 'http://%s:%d' % self.server.server_address
+		headers = {}
+		if parts.path.endswith('/repos'):
+			page = int(parse_qs(parts.query).get('page', ['1'])[0])
+			type(self).pages_served.append(page)
+			last = -(-len(BIG_REPOS) // PER_PAGE)
+			body = BIG_REPOS[(page - 1) * PER_PAGE:page * PER_PAGE]
+			url = base + parts.path + '?per_page=%d' % PER_PAGE
+			links = []
+			if page < last:
+				links.append('<%s&page=%d>; rel="next"' % (url, page + 1))
+				if type(self).with_last:
+					links.append('<%s&page=%d>; rel="last"' % (url, last))
+			if links:
+				headers['Link'] = ', '.join(links)
+		else:
+			org = parts.path.rsplit('/', 1)[-1]
+			body = dict(fixtures.org_payload, login=org,
+				repos_url=base + parts.path + '/repos')
+		data = json.dumps(body).encode()
+		headers['ETag'] = '"%08x"' % (hash(data) & 0xffffffff)
+		if cls.cache_control is not None:
+			headers['Cache-Control'] = cls.cache_control
+		if self.headers.get('If-None-Match') == headers['ETag']:
+			with cls.lock:
+				cls.not_modified += 1
+			self.send_response(304)
+			data = b''
+		else:
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, *args):
+		pass
+
+
+class FakeGithubMixin:
+	"""Runs _FakeGithub for the test class, points GithubOrgClient at it
+	and resets the handler's settings and counters before each test.
+	"""
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeGithub)
+		threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+		cls.org_url = 'http://127.0.0.1:%d/orgs/{org}' % cls.server.server_address[1]
+		cls.org_patcher = patch.object(GithubOrgClient, 'ORG_URL', cls.org_url)
+		cls.org_patcher.start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.org_patcher.stop()
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		_FakeGithub.with_last = True
+		_FakeGithub.delay = 0.0
+		_FakeGithub.cache_control = None
+		_FakeGithub.status = None
+		_FakeGithub.max_in_flight = 0
+		_FakeGithub.pages_served = []
+		_FakeGithub.paths_served = []
+		_FakeGithub.connections = set()
+		_FakeGithub.not_modified = 0
+
+
+class TestPaginationGithubOrgClient(FakeGithubMixin, unittest.TestCase):
+	"""public_repos against a local fake API serving many pages."""
+
+	def test_all_pages_in_order(self):
+		repos = GithubOrgClient('google').public_repos()
+		self.assertEqual(repos, [r['name'] for r in BIG_REPOS])
+		self.assertEqual(sorted(_FakeGithub.pages_served), list(range(1, 22)))
+
+	def test_license_filter(self):
+		repos = GithubOrgClient('google').public_repos(license='apache-2.0')
+		self.assertEqual(repos, [r['name'] for r in BIG_REPOS
+			if r['license']['key'] == 'apache-2.0'])
+
+	def test_pages_fetched_concurrently(self):
+		_FakeGithub.delay = 0.02
+		repos = GithubOrgClient('google', max_workers=4).public_repos()
+		self.assertEqual(len(repos), len(BIG_REPOS))
+		self.assertGreater(_FakeGithub.max_in_flight, 1)
+		self.assertLessEqual(_FakeGithub.max_in_flight, 4)
+
+	def test_pages_reuse_connections(self):
+		repos = GithubOrgClient('google', max_workers=4).public_repos()
+		self.assertEqual(len(repos), len(BIG_REPOS))
+		# 22 requests over the shared session's keep-alive connections
+		self.assertLessEqual(len(_FakeGithub.connections), 5)
+
+	def test_follows_next_without_last(self):
+		_FakeGithub.with_last = False
+		repos = GithubOrgClient('google').public_repos()
+		self.assertEqual(repos, [r['name'] for r in BIG_REPOS])
+		self.assertEqual(_FakeGithub.pages_served, list(range(1, 22)))
+
+	def test_stream(self):
+		_FakeGithub.delay = 0.01
+		names = GithubOrgClient('google', max_workers=2).public_repos(stream=True)
+		first = [next(names) for _ in range(PER_PAGE)]
+		self.assertEqual(first, [r['name'] for r in BIG_REPOS[:PER_PAGE]])
+		names.close()
+		# Stopping early leaves most pages unfetched
+		self.assertLess(len(_FakeGithub.pages_served), 21)
+
+	def test_link_helpers(self):
+		header = ('<https://api.github.com/x?page=2>; rel="next", '
+			'<https://api.github.com/x?page=5>; rel="last"')
+		self.assertEqual(parse_link_header(header), {
+			'next': 'https://api.github.com/x?page=2',
+			'last': 'https://api.github.com/x?page=5'})
+		self.assertEqual(parse_link_header(None), {})
+		self.assertEqual(with_page('https://h/x?per_page=10&page=5', 3),
+			'https://h/x?per_page=10&page=3')
+
+
+class TestResponseCache(FakeGithubMixin, unittest.TestCase):
+	"""GithubOrgClient with an on-disk ResponseCache, against the fake API."""
+	def setUp(self):
+		super().setUp()
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, 'cache.db')
+		self.caches = []
+
+	def tearDown(self):
+		for cache in self.caches:
+			cache.close()
+		self.tmp.cleanup()
+
+	def open_cache(self, **kwargs):
+		cache = ResponseCache(self.path, **kwargs)
+		self.caches.append(cache)
+		return cache
+
+	def test_org_fetched_once_per_client(self):
+		gh = GithubOrgClient('google')
+		gh.public_repos()
+		gh.public_repos()
+		org_path = urlsplit(self.org_url.format(org='google')).path
+		self.assertEqual(_FakeGithub.paths_served.count(org_path), 1)
+
+	def test_survives_restart(self):
+		expected = [r['name'] for r in BIG_REPOS]
+		cache = self.open_cache()
+		self.assertEqual(GithubOrgClient('google', cache=cache).public_repos(), expected)
+		self.assertEqual(len(_FakeGithub.paths_served), 22)
+		cache.close()
+		# A new cache on the same file, as after a process restart
+		cache = self.open_cache()
+		self.assertEqual(GithubOrgClient('google', cache=cache).public_repos(), expected)
+		self.assertEqual(len(_FakeGithub.paths_served), 22)
+		self.assertEqual(cache.stats()['fresh'], 22)
+		self.assertEqual(cache.stats()['entries'], 22)
+
+	def test_revalidates_when_expired(self):
+		cache = self.open_cache(ttl=0)
+		url = self.org_url.format(org='google')
+		first = cache.get_json(url)
+		self.assertEqual(cache.get(url).source, 'revalidated')
+		self.assertEqual(cache.get_json(url), first)
+		self.assertEqual(_FakeGithub.not_modified, 2)
+
+	def test_cache_control_max_age(self):
+		_FakeGithub.cache_control = 'private, max-age=60'
+		cache = self.open_cache(ttl=0)
+		url = self.org_url.format(org='google')
+		cache.get(url)
+		self.assertEqual(cache.get(url).source, 'fresh')
+		self.assertEqual(len(_FakeGithub.paths_served), 1)
+
+	def test_no_store_is_not_kept(self):
+		_FakeGithub.cache_control = 'no-store'
+		cache = self.open_cache()
+		url = self.org_url.format(org='google')
+		payload = cache.get_json(url)
+		self.assertEqual(cache.get_json(url), payload)
+		self.assertEqual(len(_FakeGithub.paths_served), 2)
+		self.assertEqual(_FakeGithub.not_modified, 0)
+		self.assertEqual(cache.stats()['entries'], 0)
+
+	def test_no_cache_always_revalidates(self):
+		_FakeGithub.cache_control = 'no-cache, max-age=60'
+		cache = self.open_cache()
+		url = self.org_url.format(org='google')
+		cache.get(url)
+		self.assertEqual(cache.get(url).source, 'revalidated')
+		self.assertEqual(cache.get(url).source, 'revalidated')
+		self.assertEqual(_FakeGithub.not_modified, 2)
+
+	def test_fresh_hits_do_not_write(self):
+		cache = self.open_cache(max_entries=2)
+		urls = [self.org_url.format(org=org) for org in ('a', 'b')]
+		for url in urls:
+			cache.get(url)
+		conn = cache._connection()
+		changes = conn.total_changes
+		for _ in range(50):
+			cache.get(urls[0])
+		self.assertEqual(conn.total_changes, changes)
+		# The batched access times still drive LRU eviction
+		cache.get(self.org_url.format(org='c'))
+		self.assertEqual(cache.get(urls[0]).source, 'fresh')
+		self.assertEqual(cache.stats()['evicted'], 1)
+
+	def test_stale_on_server_error(self):
+		cache = self.open_cache(ttl=0)
+		url = self.org_url.format(org='google')
+		payload = cache.get_json(url)
+		_FakeGithub.status = 503
+		self.assertEqual(cache.get(url).source, 'stale')
+		_FakeGithub.status = None
+		self.assertEqual(cache.get_json(url), payload)
+
+	def test_stale_on_connection_error(self):
+		cache = self.open_cache(ttl=0)
+		url = self.org_url.format(org='google')
+		payload = cache.get_json(url)
+		with patch('response_cache.get_session') as mock_session:
+			mock_session.return_value.get.side_effect = requests.ConnectionError
+			response = cache.get(url)
+		self.assertEqual(response.source, 'stale')
+		self.assertEqual(response.json(), payload)
+
+	def test_evict_by_entries_and_bytes(self):
+		cache = self.open_cache(max_entries=5)
+		GithubOrgClient('google', cache=cache).public_repos()
+		self.assertEqual(cache.stats()['entries'], 5)
+		self.assertEqual(cache.stats()['evicted'], 17)
+		cache.max_entries = None
+		cache.max_bytes = cache.stats()['bytes'] // 2
+		cache.evict()
+		self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+
+	def test_evict_by_age(self):
+		cache = self.open_cache()
+		GithubOrgClient('google', cache=cache).public_repos()
+		cache.max_age = 0
+		time.sleep(0.01)
+		self.assertEqual(cache.evict(), 22)
+		self.assertEqual(cache.stats()['entries'], 0)
+
+
 if __name__ == '__main__':
 	unittest.main()
 
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
+import gc
+import json
+import threading
+import time
 import unittest
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch
 
 # Lightweight parameterized.expand replacement to avoid extra dependency
@@ -15,7 +21,10 @@ def parameterized_expand(cases):
 
 parameterized = parameterized_expand
 
-from utils import access_nested_map, get_json, memoize
+import utils
+from utils import (MISSING, HTTPCache, access_many, access_nested_map,
+	compile_path, compile_paths, configure_session, extract_paths, get_json,
+	get_session, memoize)
 
 
 class TestAccessNestedMap(unittest.TestCase):
@@ -42,6 +51,83 @@ class TestAccessNestedMap(unittest.TestCase):
 				self.assertEqual(str(ctx.exception), repr(path[-1]))
 
 
+class TestCompiledPaths(unittest.TestCase):
+	def test_compile_path(self):
+		cases = [
+			({"a": 1}, ("a",), 1),
+			({"a": {"b": 2}}, ("a",), {"b": 2}),
+			({"a": {"b": 2}}, ("a", "b"), 2),
+			({"a": 1}, (), {"a": 1}),
+			({None: {0: "x"}}, (None, 0), "x"),
+		]
+		for nested_map, path, expected in cases:
+			with self.subTest(nested_map=nested_map, path=path):
+				self.assertEqual(compile_path(path)(nested_map), expected)
+
+	def test_compile_path_exception(self):
+		cases = [
+			({}, ("a",)),
+			({"a": 1}, ("a", "b")),
+			({"a": [1]}, ("a", 0)),
+		]
+		for nested_map, path in cases:
+			with self.subTest(nested_map=nested_map, path=path):
+				with self.assertRaises(KeyError) as ctx:
+					compile_path(path)(nested_map)
+				self.assertEqual(str(ctx.exception), repr(path[-1]))
+				self.assertIs(compile_path(path)(nested_map, MISSING), MISSING)
+
+	def test_deep_path(self):
+		path = tuple(range(60))
+		nested_map = "leaf"
+		for key in reversed(path):
+			nested_map = {key: nested_map}
+		self.assertEqual(compile_path(path)(nested_map), "leaf")
+		self.assertEqual(compile_paths((path, (0,)))([nested_map])[0], ["leaf"])
+		with self.assertRaises(KeyError):
+			compile_path(path + (60,))(nested_map)
+		self.assertIs(compile_path(path[:-1] + (-1,))(nested_map, MISSING), MISSING)
+
+	def test_compile_path_is_cached(self):
+		self.assertIs(compile_path(("a", "b")), compile_path(("a", "b")))
+
+	def test_dict_subclass(self):
+		class Record(dict):
+			pass
+
+		self.assertEqual(compile_path(("a", "b"))(Record(a=Record(b=3))), 3)
+
+	def test_access_many(self):
+		maps = [{"a": {"b": i}} for i in range(3)] + [{"a": None}]
+		self.assertEqual(access_many(maps, ("a", "b"), None), [0, 1, 2, None])
+		with self.assertRaises(KeyError):
+			access_many(maps, ("a", "b"))
+
+	def test_extract_paths(self):
+		maps = [
+			{"id": 1, "owner": {"login": "x", "site": {"url": "u"}}},
+			{"id": 2, "owner": {"login": "y"}},
+			{"id": 3},
+		]
+		paths = [("id",), ("owner", "login"), ("owner", "site", "url"), ("owner",)]
+		ids, logins, urls, owners = extract_paths(maps, paths, default=None)
+		self.assertEqual(ids, [1, 2, 3])
+		self.assertEqual(logins, ["x", "y", None])
+		self.assertEqual(urls, ["u", None, None])
+		self.assertEqual(owners, [maps[0]["owner"], maps[1]["owner"], None])
+		self.assertEqual(extract_paths(iter(maps), [("id",)]), [[1, 2, 3]])
+
+	def test_extract_paths_exception(self):
+		with self.assertRaises(KeyError) as ctx:
+			extract_paths([{"a": {}}], [("a",), ("a", "b")])
+		self.assertEqual(str(ctx.exception), repr("b"))
+
+	def test_compile_paths_is_cached(self):
+		paths = (("a", "b"), ("a", "c"))
+		self.assertIs(compile_paths(paths), compile_paths(paths))
+		self.assertEqual(compile_paths(paths)([{"a": {"b": 1, "c": 2}}]), [[1], [2]])
+
+
 class TestGetJson(unittest.TestCase):
 	def test_get_json(self):
 		cases = [
@@ -52,12 +138,135 @@ class TestGetJson(unittest.TestCase):
 			with self.subTest(test_url=test_url):
 				mock_resp = unittest.mock.Mock()
 				mock_resp.json.return_value = test_payload
-				with patch('utils.requests.get', return_value=mock_resp) as mock_get:
+				with patch('utils.get_session') as mock_session:
+					mock_get = mock_session.return_value.get
+					mock_get.return_value = mock_resp
 					result = get_json(test_url)
 					mock_get.assert_called_once_with(test_url)
 					self.assertEqual(result, test_payload)
 
 
+class _Handler(BaseHTTPRequestHandler):
+	"""Serves {"path": ...} with an ETag and answers 304 when it matches."""
+	protocol_version = 'HTTP/1.1'
+	requests_seen = []
+
+	def do_GET(self):
+		type(self).requests_seen.append((self.path, self.headers.get('If-None-Match'),
+			self.client_address[1]))
+		body = json.dumps({"path": self.path}).encode()
+		etag = '"%s"' % self.path.strip('/')
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		if not self.path.startswith('/nocache'):
+			self.send_header('ETag', etag)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class TestGetJsonHTTP(unittest.TestCase):
+	"""get_json against a local stand-in server."""
+	@classmethod
+	def setUpClass(cls):
+		cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+		cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+		cls.thread.start()
+		cls.base = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+
+	def setUp(self):
+		_Handler.requests_seen = []
+		self.cache = HTTPCache()
+
+	def test_revalidates_with_etag(self):
+		url = self.base + '/orgs/google'
+		self.assertEqual(get_json(url, cache=self.cache), {"path": "/orgs/google"})
+		self.assertEqual(get_json(url, cache=self.cache), {"path": "/orgs/google"})
+		self.assertEqual([seen[1] for seen in _Handler.requests_seen],
+			[None, '"orgs/google"'])
+		self.assertEqual(self.cache.stats(),
+			{'misses': 1, 'revalidated': 1, 'entries': 1})
+
+	def test_cached_payload_is_not_shared(self):
+		url = self.base + '/orgs/abc'
+		get_json(url, cache=self.cache)["path"] = "changed"
+		self.assertEqual(get_json(url, cache=self.cache), {"path": "/orgs/abc"})
+
+	def test_no_validator_is_not_cached(self):
+		url = self.base + '/nocache'
+		get_json(url, cache=self.cache)
+		get_json(url, cache=self.cache)
+		self.assertEqual([seen[1] for seen in _Handler.requests_seen], [None, None])
+		self.assertEqual(self.cache.stats()['entries'], 0)
+
+	def test_stale_entry_dropped_on_plain_200(self):
+		url = self.base + '/nocache'
+		self.cache.set(url, '"old"', None, b'{"path": "stale"}')
+		self.assertEqual(get_json(url, cache=self.cache), {"path": "/nocache"})
+		self.assertEqual(self.cache.stats()['entries'], 0)
+
+	def test_connections_are_reused(self):
+		for i in range(5):
+			get_json('%s/repos/%d' % (self.base, i), cache=None)
+		ports = {seen[2] for seen in _Handler.requests_seen}
+		self.assertEqual(len(ports), 1)
+
+	def isolate_session(self):
+		previous = utils._session
+		utils._session = None
+
+		def restore():
+			if utils._session is not None:
+				utils._session.close()
+			utils._session = previous
+		self.addCleanup(restore)
+
+	def test_first_use_race_builds_one_session(self):
+		self.isolate_session()
+		barrier = threading.Barrier(8)
+		sessions = []
+
+		def call():
+			barrier.wait()
+			sessions.append(get_session())
+
+		threads = [threading.Thread(target=call) for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(sessions), 8)
+		self.assertTrue(all(s is sessions[0] for s in sessions))
+
+	def test_shared_session(self):
+		self.isolate_session()
+		self.assertIs(get_session(), get_session())
+		session = configure_session(pool_maxsize=2)
+		self.assertIs(get_session(), session)
+		results = []
+		threads = [threading.Thread(target=lambda i=i: results.append(
+			get_json('%s/t/%d' % (self.base, i), cache=None))) for i in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(results), 8)
+
+
 class TestMemoize(unittest.TestCase):
 	def test_memoize(self):
 		class TestClass:
@@ -74,6 +283,138 @@ class TestMemoize(unittest.TestCase):
 			self.assertEqual(obj.a_property(), 42)
 			mock_meth.assert_called_once()
 
+	def test_memoize_arguments(self):
+		class TestClass:
+			def __init__(self):
+				self.calls = 0
+
+			@memoize
+			def add(self, a, b=0):
+				self.calls += 1
+				return a + b
+
+		obj = TestClass()
+		self.assertEqual(obj.add(1, b=2), 3)
+		self.assertEqual(obj.add(1, b=2), 3)
+		self.assertEqual(obj.add(2), 2)
+		self.assertEqual(obj.calls, 2)
+		# Instances don't share results
+		self.assertEqual(TestClass().add(1, b=2), 3)
+		info = TestClass.add.cache_info()
+		self.assertEqual((info['hits'], info['misses']), (1, 3))
+
+	def test_memoize_unhashable_arguments(self):
+		class TestClass:
+			@memoize
+			def total(self, values):
+				return sum(values)
+
+		obj = TestClass()
+		self.assertEqual(obj.total([1, 2]), 3)
+		self.assertEqual(TestClass.total.cache_info()['uncacheable'], 1)
+
+	def test_memoize_maxsize_and_ttl(self):
+		class TestClass:
+			calls = []
+
+			@memoize(maxsize=2)
+			def bounded(self, x):
+				self.calls.append(x)
+				return x
+
+			@memoize(ttl=0.05)
+			def expiring(self):
+				self.calls.append('ttl')
+				return len(self.calls)
+
+		obj = TestClass()
+		for x in (1, 2, 3, 1):
+			obj.bounded(x)
+		self.assertEqual(TestClass.calls, [1, 2, 3, 1])
+		self.assertEqual(TestClass.bounded.cache_info()['evictions'], 2)
+		first = obj.expiring()
+		self.assertEqual(obj.expiring(), first)
+		time.sleep(0.06)
+		self.assertNotEqual(obj.expiring(), first)
+
+	def test_memoize_computes_once_under_concurrency(self):
+		calls = []
+
+		class TestClass:
+			@memoize
+			def slow(self):
+				calls.append(1)
+				time.sleep(0.05)
+				return 42
+
+		obj = TestClass()
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(obj.slow()))
+			for _ in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(results, [42] * 8)
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(TestClass.slow.cache_info()['waits'], 7)
+
+	def test_memoize_slots(self):
+		class Slotted:
+			__slots__ = ('value', '__weakref__')
+
+			def __init__(self, value):
+				self.value = value
+
+			@memoize
+			def double(self):
+				return self.value * 2
+
+		obj = Slotted(21)
+		self.assertEqual(obj.double(), 42)
+		self.assertEqual(obj.double(), 42)
+		ref = weakref.ref(obj)
+		del obj
+		gc.collect()
+		# The cache must not keep the instance alive
+		self.assertIsNone(ref())
+
+	def test_memoize_slots_without_weakref(self):
+		class Slotted:
+			__slots__ = ('value',)
+			calls = 0
+
+			def __init__(self, value):
+				self.value = value
+
+			@memoize
+			def value_of(self):
+				Slotted.calls += 1
+				return self.value
+
+		first, second = Slotted(1), Slotted(2)
+		self.assertEqual([first.value_of(), first.value_of()], [1, 1])
+		self.assertEqual([second.value_of(), second.value_of()], [2, 2])
+		self.assertEqual(Slotted.calls, 2)
+		self.assertEqual(Slotted.value_of.cache_info()['hits'], 2)
+		Slotted.value_of.cache_clear()
+		self.assertEqual(first.value_of(), 1)
+		self.assertEqual(Slotted.calls, 3)
+
+	def test_memoize_cache_clear(self):
+		class TestClass:
+			calls = 0
+
+			@memoize
+			def value(self):
+				TestClass.calls += 1
+				return TestClass.calls
+
+		obj = TestClass()
+		self.assertEqual(obj.value(), 1)
+		TestClass.value.cache_clear()
+		self.assertEqual(obj.value(), 2)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -1,40 +1,501 @@
 #!/usr/bin/env python3
 import functools
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
 import requests
+from requests.adapters import HTTPAdapter
 
 
-def access_nested_map(nested_map, path):
-    """Access a nested map using path (tuple of keys) and return the value.
-    Raise KeyError if any key is missing.
-    """
+# Returned by compiled accessors for a missing path when asked to, so hot
+# loops can test `value is MISSING` instead of catching KeyError
+MISSING = object()
+_RAISE = object()
+_ABSENT = object()
+# Generated lookups nest two blocks per key and Python caps indentation at
+# 100 levels, so longer paths are left to _walk
+_MAX_COMPILED_DEPTH = 32
+
+
+def _walk(nested_map, path, default=_RAISE):
     current = nested_map
     for key in path:
         if isinstance(current, dict) and key in current:
             current = current[key]
-        else:
+        elif default is _RAISE:
             raise KeyError(key)
+        else:
+            return default
     return current
 
 
-def get_json(url):
-    """Get JSON payload from URL using requests.get and return .json()."""
-    resp = requests.get(url)
+def _trie_lines(paths, indent):
+    """Source lines that set r<i> to the value at paths[i] of `root`, or
+    leave it _ABSENT. Paths are merged into a trie so a shared prefix is
+    looked up once. Only exact dicts take this route; anything else, and
+    any path deeper than _MAX_COMPILED_DEPTH, is left to _walk, which also
+    produces the KeyError.
+    """
+    trie = {}
+    for i, path in enumerate(paths):
+        if len(path) > _MAX_COMPILED_DEPTH:
+            continue
+        node = trie
+        for key in path:
+            node = node.setdefault(key, {})
+        node.setdefault(_ABSENT, []).append(i)
+
+    keys = {}
+    lines = []
+
+    def emit(node, var, depth):
+        pad = ' ' * (indent + 4 * depth)
+        for i in node.get(_ABSENT, ()):
+            lines.append(f'{pad}r{i} = {var}')
+        children = [key for key in node if key is not _ABSENT]
+        if not children:
+            return
+        lines.append(f'{pad}if type({var}) is dict:')
+        for key in children:
+            name = f'k{len(keys)}'
+            keys[name] = key
+            child = f'v{len(keys)}'
+            lines.append(f'{pad}    if {name} in {var}:')
+            lines.append(f'{pad}        {child} = {var}[{name}]')
+            emit(node[key], child, depth + 2)
+
+    emit(trie, 'root', 0)
+    return lines, keys
+
+
+def _generate(name, paths, head, tail, indent):
+    """Exec `head` + trie lookups for `paths` + `tail` inside a factory
+    and return the function `name` it defines. Keys and helpers reach
+    the generated code as closure variables, which are cheaper to read
+    than globals.
+    """
+    trie, keys = _trie_lines(paths, indent)
+    helpers = {'_ABSENT': _ABSENT, '_RAISE': _RAISE, '_walk': _walk,
+               'dict': dict, 'type': type, 'paths': paths}
+    helpers.update(keys)
+    lines = [f"def make({', '.join(helpers)}):"] + head + trie + tail
+    lines.append(f'    return {name}')
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['make'](**helpers)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_path(path):
+    """Compile `path` (a tuple of keys) into an accessor
+    `get(nested_map, default=<raise>)` equivalent to access_nested_map.
+
+    The accessor is generated code with the keys unrolled, so there is no
+    per-call loop. When the path is missing it raises KeyError like
+    access_nested_map, or returns `default` if one is given (MISSING is
+    provided as a sentinel for that). Accessors are cached per path.
+    """
+    path = tuple(path)
+    get = _generate('get', (path,), [
+        '    def get(root, default=_RAISE):',
+        '        r0 = _ABSENT',
+    ], [
+        '        if r0 is not _ABSENT:',
+        '            return r0',
+        '        return _walk(root, paths[0], default)',
+    ], indent=8)
+    get.path = path
+    return get
+
+
+@functools.lru_cache(maxsize=256)
+def compile_paths(paths):
+    """Compile several paths (a tuple of key tuples) into one extractor
+    `extract(maps, default=<raise>)` that returns one list per path,
+    holding that path's value in every map of the iterable `maps`.
+
+    Paths are merged into a trie so a shared prefix is looked up once per
+    map, however many paths go through it, and the loop over `maps` runs
+    in the generated code. Missing paths behave as in compile_path.
+    """
+    paths = tuple(tuple(p) for p in paths)
+    columns = range(len(paths))
+    head = ['    def extract(maps, default=_RAISE):']
+    head += [f'        c{i} = []' for i in columns]
+    head += [f'        a{i} = c{i}.append' for i in columns]
+    head += ['        for root in maps:']
+    head += [f"            {' = '.join(f'r{i}' for i in columns)} = _ABSENT"
+             if paths else '            pass']
+    tail = [f'            a{i}(r{i} if r{i} is not _ABSENT '
+            f'else _walk(root, paths[{i}], default))' for i in columns]
+    tail += [f"        return [{', '.join(f'c{i}' for i in columns)}]"]
+    extract = _generate('extract', paths, head, tail, indent=12)
+    extract.paths = paths
+    return extract
+
+
+def access_nested_map(nested_map, path, default=_RAISE):
+    """Access a nested map using path (tuple of keys) and return the value.
+    Raise KeyError if any key is missing, or return `default` if given.
+    For the same path over many maps use compile_path / access_many.
+    """
+    return _walk(nested_map, path, default)
+
+
+def access_many(maps, path, default=_RAISE):
+    """Return [access_nested_map(m, path, default) for m in maps], with the
+    loop itself in generated code (see compile_paths).
+    """
+    return compile_paths((tuple(path),))(maps, default)[0]
+
+
+def extract_paths(maps, paths, default=_RAISE):
+    """Return one list of values per path in `paths` (columns), reading
+    every map of `maps` once; see compile_paths.
+    """
+    return compile_paths(tuple(tuple(p) for p in paths))(maps, default)
+
+
+class HTTPCache:
+    """Thread-safe LRU of validated responses: url -> (ETag,
+    Last-Modified, body). get_json revalidates a cached URL with
+    If-None-Match / If-Modified-Since and reuses the body on a 304.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'misses': 0, 'revalidated': 0}
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def set(self, url, etag, last_modified, body):
+        with self._lock:
+            self._entries[url] = (etag, last_modified, body)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def record(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['entries'] = len(self._entries)
+        return snapshot
+
+
+http_cache = HTTPCache()
+_session = None
+_session_lock = threading.Lock()
+
+
+def _new_session(pool_connections=10, pool_maxsize=10, max_retries=0):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_session(pool_connections=10, pool_maxsize=10, max_retries=0):
+    """Replace the shared session with one whose connection pool keeps
+    `pool_maxsize` keep-alive connections per host (for up to
+    `pool_connections` hosts) and return it. The previous session is
+    closed.
+    """
+    global _session
+    session = _new_session(pool_connections, pool_maxsize, max_retries)
+    with _session_lock:
+        previous, _session = _session, session
+    if previous is not None:
+        previous.close()
+    return session
+
+
+def get_session():
+    """Return the shared requests.Session, creating it on first use.
+    Its connection pool is thread-safe, so threads share the keep-alive
+    connections instead of opening one per request.
+    """
+    global _session
+    session = _session
+    if session is None:
+        with _session_lock:
+            # Built under the lock so racing first callers share one session
+            if _session is None:
+                _session = _new_session()
+            session = _session
+    return session
+
+
+def get_json(url, cache=http_cache):
+    """Get JSON payload from URL over the shared session and return it.
+    A response carrying an ETag or Last-Modified is kept in `cache`; the
+    next call revalidates it and a 304 reuses the cached body. Any other
+    200 drops what was cached for the URL. Pass
+    cache=None to always fetch the full response.
+    """
+    entry = cache.get(url) if cache is not None else None
+    if entry is None:
+        resp = get_session().get(url)
+    else:
+        etag, last_modified, body = entry
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        resp = get_session().get(url, headers=headers)
+        if resp.status_code == 304:
+            cache.record('revalidated')
+            # Parse again rather than hand out a shared, mutable payload
+            return json.loads(body)
+    if cache is not None:
+        cache.record('misses')
+        if resp.status_code == 200:
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+            if etag or last_modified:
+                cache.set(url, etag, last_modified, resp.content)
+            else:
+                cache.discard(url)
     return resp.json()
 
 
-def memoize(func):
-    """Simple memoize decorator that caches results on the instance.
-    Works with instance methods: stores cached values on the instance
-    with attribute name '_memoized_<func_name>'.
+_KWARGS_MARK = object()
+
+
+class _Flight:
+    """A value being computed for one key; other callers wait on it."""
+    __slots__ = ('event', 'thread', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.thread = threading.get_ident()
+        self.value = None
+        self.error = None
+
+
+class MemoCache:
+    """Results of one memoized method, for one instance or for all of
+    them. Optional LRU bound (`maxsize`) and expiry (`ttl` seconds).
+    Concurrent misses on the same key compute the value once: the first
+    caller computes it and the others wait for its result.
     """
+    def __init__(self, maxsize=None, ttl=None, stats=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = stats if stats is not None else _MemoStats()
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        if self.maxsize is None and self.ttl is None:
+            # Unbounded, no expiry: a plain dict read is enough on a hit
+            entry = self._data.get(key)
+            if entry is not None:
+                self.stats.add('hits')
+                return entry[0]
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                if self.maxsize is not None:
+                    self._data.move_to_end(key)
+                self.stats.add('hits')
+                return entry[0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            if flight.thread == threading.get_ident():
+                # Recursive call for the key being computed: don't wait on ourselves
+                return compute()
+            flight.event.wait()
+            self.stats.add('waits')
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self.stats.add('misses')
+        try:
+            flight.value = value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            expires = None if self.ttl is None else time.monotonic() + self.ttl
+            with self._lock:
+                self._data[key] = (value, expires)
+                if self.maxsize is not None:
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+                        self.stats.add('evictions')
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _MemoStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ('hits', 'misses', 'waits', 'evictions', 'uncacheable'), 0)
+
+    def add(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class _SideTable:
+    """Per-instance caches for objects without a __dict__ (__slots__
+    classes), keyed by id and dropped when the instance is collected, so
+    the table never keeps an instance alive. get() returns None for an
+    instance that can't be weakly referenced either.
+    """
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get(self, instance, create):
+        key = id(instance)
+        entry = self._caches.get(key)
+        if entry is not None and entry[0]() is instance:
+            return entry[1]
+        try:
+            ref = weakref.ref(instance, lambda r: self._drop(key, r))
+        except TypeError:
+            return None
+        with self._lock:
+            entry = self._caches.get(key)
+            if entry is None or entry[0]() is not instance:
+                entry = self._caches[key] = (ref, create())
+            return entry[1]
+
+    def _drop(self, key, ref):
+        with self._lock:
+            entry = self._caches.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._caches[key]
+
+    def __len__(self):
+        return len(self._caches)
+
+
+def memoize(func=None, *, maxsize=None, ttl=None, per_instance=True):
+    """Memoize a method: results are cached per set of arguments and
+    returned without calling the method again.
+
+    per_instance=True keeps one cache per instance, stored in its
+    __dict__ under '_memoized_<func_name>' or, for __slots__ classes, in
+    a side table of weak references that doesn't keep instances alive.
+    Instances with neither a __dict__ nor a __weakref__ slot fall back to
+    one cache keyed by instance, as with per_instance=False.
+    per_instance=False shares one cache between all instances (the
+    instance is part of the key and is kept alive by its entries, so give
+    it a maxsize). `maxsize` bounds each cache LRU-style and `ttl` expires
+    entries after that many seconds. Concurrent calls that miss on the
+    same key compute the value once. Calls whose arguments aren't hashable
+    are not cached.
+
+    The wrapper exposes cache_info() (hits, misses, waits, evictions,
+    uncacheable) and cache_clear().
+    """
+    if func is None:
+        return functools.partial(memoize, maxsize=maxsize, ttl=ttl,
+                                 per_instance=per_instance)
     attr_name = f"_memoized_{func.__name__}"
+    stats = _MemoStats()
+    side_table = _SideTable()
+    shared = None if per_instance else MemoCache(maxsize, ttl, stats)
+    # For instances the side table can't track either
+    unreferenceable = MemoCache(maxsize, ttl, stats)
+    # Every per-instance cache, for cache_clear; entries go with their instance
+    caches = weakref.WeakSet()
+    caches_lock = threading.Lock()
+
+    def new_cache():
+        cache = MemoCache(maxsize, ttl, stats)
+        with caches_lock:
+            caches.add(cache)
+        return cache
+
+    def cache_for(instance):
+        if shared is not None:
+            return shared
+        try:
+            namespace = instance.__dict__
+        except AttributeError:
+            return side_table.get(instance, new_cache)
+        cache = namespace.get(attr_name)
+        if cache is None:
+            # setdefault is atomic, so racing first calls share one cache
+            cache = namespace.setdefault(attr_name, new_cache())
+        return cache
 
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        if hasattr(self, attr_name):
-            return getattr(self, attr_name)
-        result = func(self, *args, **kwargs)
-        setattr(self, attr_name, result)
-        return result
+        key = args
+        if kwargs:
+            key += (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+        cache = cache_for(self)
+        if cache is None:
+            cache = unreferenceable
+        if cache is shared or cache is unreferenceable:
+            key = (self,) + key
+        try:
+            hash(key)
+        except TypeError:
+            stats.add('uncacheable')
+            return func(self, *args, **kwargs)
+        return cache.get_or_compute(key, lambda: func(self, *args, **kwargs))
+
+    def cache_clear():
+        """Drop every cached result, for all instances."""
+        if shared is not None:
+            shared.clear()
+        unreferenceable.clear()
+        with caches_lock:
+            live = list(caches)
+        for cache in live:
+            cache.clear()
 
+    wrapper.cache_info = stats.snapshot
+    wrapper.cache_clear = cache_clear
     return wrapper
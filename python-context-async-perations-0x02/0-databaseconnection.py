@@ -1,35 +1,102 @@
 #!/usr/bin/env python3
-import sqlite3
+
+from connections import active_connections, connect, connection_cache, snapshot_uri
+from deadlines import Deadline
 
 
 class DatabaseConnection:
     """Class-based context manager that opens a sqlite3 connection to
     'users.db' and returns a cursor when entering the context. The
     connection is closed when exiting the context.
+
+    profile  name from connections.PROFILES ('read_heavy', 'bulk_load',
+             'balanced', ...) or (pragma, value) pairs applied on connect.
+    reuse    take a warm connection from connections.connection_cache and
+             hand it back on exit instead of connecting and closing.
+    deadline seconds; a statement still running that long after entering
+             is interrupted and deadlines.QueryTimeout is raised.
+    snapshot open the file read-only and immutable (no locking, journal
+             checks or writes) with a large mmap; for frozen copies made
+             by connections.take_snapshot.
+
+    The manager is re-entrant: a block nested inside another block on the
+    same database in the same thread (same instance or not) gets a new
+    cursor on the outer block's connection, so it shares its transaction.
+    Only the outermost exit closes (or returns) the connection; work that
+    wasn't committed is discarded then, as with a plain close().
     """
-    def __init__(self, db_path='users.db'):
+    def __init__(self, db_path='users.db', profile=None, reuse=False,
+                 deadline=None, snapshot=False):
         self.db_path = db_path
+        self.profile = profile
+        self.reuse = reuse
+        self.deadline = deadline
+        self.snapshot = snapshot
+        # Snapshot and regular blocks on one file must not share a connection
+        self._key = snapshot_uri(db_path) if snapshot else db_path
         self.conn = None
         self.cursor = None
+        self._cursors = []
+        self._deadlines = []
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        active = active_connections()
+        entry = active.get(self._key)
+        if entry is None:
+            if self.reuse:
+                conn = connection_cache.get(self.db_path, self.profile,
+                                            snapshot=self.snapshot)
+            else:
+                conn = connect(self.db_path, self.profile, self.snapshot)
+            # [connection, nesting depth, return it to the cache on exit]
+            entry = active[self._key] = [conn, 0, self.reuse]
+        entry[1] += 1
+        self.conn = entry[0]
+        try:
+            self.cursor = self.conn.cursor()
+            deadline = Deadline(self.conn, self.deadline).__enter__()
+        except Exception:
+            self._leave()
+            raise
+        self._cursors.append(self.cursor)
+        self._deadlines.append(deadline)
         return self.cursor
 
+    def _leave(self):
+        active = active_connections()
+        entry = active[self._key]
+        entry[1] -= 1
+        if entry[1]:
+            return
+        del active[self._key]
+        conn, _, reuse = entry
+        if reuse:
+            connection_cache.put(conn)
+            return
+        try:
+            # If there was an exception, let caller decide; we just close
+            conn.close()
+        except Exception:
+            pass
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # Ensure we always close the connection
-        if self.cursor:
-            try:
-                self.cursor.close()
-            except Exception:
-                pass
-        if self.conn:
-            try:
-                # If there was an exception, let caller decide; we just close
-                self.conn.close()
-            except Exception:
-                pass
+        # Ensure we always close the cursor and release the connection
+        cursor = self._cursors.pop() if self._cursors else None
+        deadline = self._deadlines.pop() if self._deadlines else None
+        try:
+            if deadline is not None:
+                # Disarms, and raises QueryTimeout if it cut a statement short
+                deadline.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            if cursor:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+            self._leave()
+            self.cursor = self._cursors[-1] if self._cursors else None
+            if not self._cursors:
+                self.conn = None
 
 
 if __name__ == '__main__':
@@ -1,38 +1,153 @@
 #!/usr/bin/env python3
 import sqlite3
+import time
+
+from columnar import ColumnarResult
+from connections import connect
+from deadlines import Deadline
 
 
 class ExecuteQuery:
     """Context manager that takes a SQL query and params, executes it on
     enter and stores the results. The connection is closed on exit.
+    With columnar=True the results are a ColumnarResult (values stored per
+    column in compact arrays) instead of a list of tuples.
+
+    With lazy=True nothing is fetched up front: the block gets an iterator
+    over the live cursor that pulls `batch_size` rows at a time as it is
+    consumed, and the cursor is closed on exit even if the block stopped
+    early, so reading the first N rows of a big result costs only N rows.
+
+    With deadline=seconds the statement is interrupted once that much time
+    has passed since entering (lazy fetches included) and
+    deadlines.QueryTimeout is raised.
+
+    With snapshot=True the database is opened read-only and immutable with
+    a large mmap (see connections.snapshot_uri): no locking and no journal
+    checks, for frozen copies made by connections.take_snapshot.
     """
-    def __init__(self, query, params=None, db_path='users.db'):
+    def __init__(self, query, params=None, db_path='users.db', columnar=False,
+                 lazy=False, batch_size=1000, deadline=None, snapshot=False):
+        if lazy and columnar:
+            raise ValueError('lazy and columnar results are mutually exclusive')
         self.query = query
         self.params = params or ()
         self.db_path = db_path
+        self.columnar = columnar
+        self.lazy = lazy
+        self.batch_size = batch_size
+        self.deadline = deadline
+        self.snapshot = snapshot
         self.conn = None
         self.cursor = None
         self.result = None
+        self._deadline = None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(self.query, self.params)
-        self.result = self.cursor.fetchall()
+        if self.snapshot:
+            self.conn = connect(self.db_path, snapshot=True)
+        else:
+            self.conn = sqlite3.connect(self.db_path)
+        self._deadline = Deadline(self.conn, self.deadline).__enter__()
+        try:
+            self.cursor = self.conn.cursor()
+            self.cursor.execute(self.query, self.params)
+            if self.lazy:
+                self.result = self._iter_rows(self.cursor)
+            elif self.columnar:
+                self.result = ColumnarResult.from_cursor(self.cursor)
+            else:
+                self.result = self.cursor.fetchall()
+        except Exception as e:
+            error = self._deadline.translate(e)
+            self.__exit__(None, None, None)
+            if error is not e:
+                raise error
+            raise
         return self.result
 
+    def _iter_rows(self, cursor):
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self._deadline is not None:
+                # Disarms, and raises QueryTimeout if it cut a fetch short
+                self._deadline.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._deadline = None
+            if self.lazy and self.result is not None:
+                # Stop the row iterator before its cursor goes away
+                self.result.close()
+            # Close cursor and connection
+            if self.cursor:
+                try:
+                    self.cursor.close()
+                except Exception:
+                    pass
+            if self.conn:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+
+
+class ExecuteBatch:
+    """Context manager that runs a list of (query, params) pairs on one
+    connection inside one read transaction, so every statement sees the
+    same snapshot of the database, and returns their results in order.
+
+    Repeated SQL text is prepared once. sqlite3 caches 128 prepared
+    statements per connection by default, so the cache is only enlarged
+    for batches with more distinct queries than that. Per-statement wall
+    time of the last run is available in `timings` as (query, seconds).
+    Like ExecuteQuery, nothing is committed; the transaction is rolled
+    back and the connection closed on exit.
+    """
+    def __init__(self, statements, db_path='users.db', profile=None):
+        self.statements = [(q, p or ()) for q, p in statements]
+        self.db_path = db_path
+        self.profile = profile
+        self.conn = None
+        self.results = None
+        self.timings = []
+
+    def __enter__(self):
+        distinct = len({q for q, _ in self.statements})
+        # 128 is sqlite3's default, so this only matters for larger batches
+        self.conn = connect(self.db_path, self.profile,
+                            cached_statements=max(128, distinct))
+        self.timings = []
+        try:
+            # One explicit transaction instead of one per statement: the
+            # read snapshot is taken by the first SELECT and kept to the end
+            self.conn.execute('BEGIN')
+            cursor = self.conn.cursor()
+            self.results = []
+            for query, params in self.statements:
+                start = time.perf_counter()
+                cursor.execute(query, params)
+                self.results.append(cursor.fetchall())
+                self.timings.append((query, time.perf_counter() - start))
+            cursor.close()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self.results
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # Close cursor and connection
-        if self.cursor:
-            try:
-                self.cursor.close()
-            except Exception:
-                pass
         if self.conn:
+            conn, self.conn = self.conn, None
             try:
-                self.conn.close()
+                conn.rollback()
             except Exception:
                 pass
+            finally:
+                conn.close()
 
 
 if __name__ == '__main__':
@@ -5,41 +5,95 @@ try:
 except Exception:
     aiosqlite = None
 
+from async_pool import close_async_pools, get_async_pool
+from async_stream import DEFAULT_CHUNK_SIZE, stream_rows
+from deadlines import QueryTimeout
+from thread_runner import close_runners, get_runner
 
-async def async_fetch_users():
-    """Fetch all users asynchronously using aiosqlite."""
-    db_path = 'users.db'
+
+async def _fetch(db, query, params):
+    try:
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchall()
+    except asyncio.CancelledError:
+        # Stop the statement on aiosqlite's thread before the connection
+        # goes back to the pool
+        await db.interrupt()
+        raise
+
+
+async def run_query(query, params=(), db_path='users.db', deadline=None):
+    """Run one query on a pooled aiosqlite connection and return all rows.
+    Without aiosqlite the query runs on a sqlite3 worker thread instead.
+
+    Cancelling the task interrupts the running statement. With
+    deadline=seconds it is interrupted after that long and QueryTimeout
+    is raised.
+    """
     if aiosqlite is None:
-        raise RuntimeError('aiosqlite is not installed')
-    async with aiosqlite.connect(db_path) as db:
-        async with db.execute("SELECT * FROM users") as cursor:
-            rows = await cursor.fetchall()
-            return rows
+        return await get_runner(db_path).fetchall(query, params, deadline)
+    async with get_async_pool(db_path).connection() as db:
+        try:
+            return await asyncio.wait_for(_fetch(db, query, params), deadline)
+        except asyncio.TimeoutError:
+            raise QueryTimeout(f"query exceeded its {deadline}s deadline") from None
+
+
+async def async_fetch_users():
+    """Fetch all users asynchronously."""
+    return await run_query("SELECT * FROM users")
 
 
 async def async_fetch_older_users():
     """Fetch users older than 40 asynchronously."""
-    db_path = 'users.db'
-    if aiosqlite is None:
-        raise RuntimeError('aiosqlite is not installed')
-    async with aiosqlite.connect(db_path) as db:
-        async with db.execute("SELECT * FROM users WHERE age > ?", (40,)) as cursor:
-            rows = await cursor.fetchall()
-            return rows
+    return await run_query("SELECT * FROM users WHERE age > ?", (40,))
 
 
-async def fetch_concurrently():
-    results = await asyncio.gather(
-        async_fetch_users(),
-        async_fetch_older_users()
-    )
-    all_users, older_users = results
-    print('All users:', all_users)
-    print('Older than 40:', older_users)
+def stream_users(min_age=None, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=4,
+                 db_path='users.db'):
+    """`async for row in stream_users():` over all users, or those older
+    than `min_age`, fetched `chunk_size` rows at a time in constant memory.
+    """
+    if min_age is None:
+        return stream_rows("SELECT * FROM users", (), db_path,
+                           chunk_size, max_chunks)
+    return stream_rows("SELECT * FROM users WHERE age > ?", (min_age,), db_path,
+                       chunk_size, max_chunks)
+
+
+async def fetch_concurrently(queries=None, max_concurrency=10):
+    """Run (query, params) pairs concurrently and return their rows in order.
+
+    At most `max_concurrency` queries are in flight at once, so fanning out
+    hundreds of them doesn't queue hundreds of coroutines on the pool. With
+    no queries, fetch all users and those older than 40 and print them.
+    """
+    if queries is None:
+        all_users, older_users = await asyncio.gather(
+            async_fetch_users(),
+            async_fetch_older_users()
+        )
+        print('All users:', all_users)
+        print('Older than 40:', older_users)
+        return [all_users, older_users]
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(query, params):
+        async with semaphore:
+            return await run_query(query, params)
+
+    return await asyncio.gather(*(bounded(query, params)
+                                  for query, params in queries))
+
+
+async def main():
+    try:
+        await fetch_concurrently()
+    finally:
+        await close_async_pools()
+        close_runners()
 
 
 if __name__ == '__main__':
-    if aiosqlite is None:
-        print('aiosqlite is not installed. Install it with: pip install aiosqlite')
-    else:
-        asyncio.run(fetch_concurrently())
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import asyncio
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+
+try:
+    import aiosqlite
+except Exception:
+    aiosqlite = None
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection is handed out before the acquire timeout."""
+
+
+class AsyncConnectionPool:
+    """asyncio pool of aiosqlite connections to one database.
+
+    At most `max_size` connections exist, so at most `max_size` aiosqlite
+    worker threads. When all are busy, acquirers wait in a FIFO queue and a
+    released connection is handed straight to the longest waiter, so a
+    steady stream of newcomers can't starve it. `connect` is the coroutine
+    function used to open connections (aiosqlite.connect by default).
+    """
+    def __init__(self, db_path='users.db', max_size=5, timeout=5.0,
+                 connect=None, pragmas=()):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = tuple(pragmas)
+        self._connect_fn = connect
+        self._idle = deque()
+        self._waiters = deque()
+        self._size = 0
+        self._closed = False
+        self._stats = {'acquired': 0, 'waits': 0, 'creations': 0, 'timeouts': 0}
+
+    async def _connect(self):
+        connect = self._connect_fn
+        if connect is None:
+            if aiosqlite is None:
+                raise RuntimeError('aiosqlite is not installed')
+            connect = aiosqlite.connect
+        conn = await connect(self.db_path)
+        try:
+            for name, value in self.pragmas:
+                await conn.execute(f"PRAGMA {name} = {value}")
+        except Exception:
+            await conn.close()
+            raise
+        self._stats['creations'] += 1
+        return conn
+
+    async def acquire(self, timeout=None):
+        """Check a connection out, waiting in line for at most `timeout`
+        seconds (the pool default if None) before raising PoolTimeout.
+        """
+        if self._closed:
+            raise RuntimeError('connection pool is closed')
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if self._idle and not self._waiters:
+                conn = self._idle.pop()
+                break
+            if self._size < self.max_size and not self._waiters:
+                # Reserve the slot before awaiting the connect
+                self._size += 1
+                try:
+                    conn = await self._connect()
+                except BaseException:
+                    self._size -= 1
+                    self._wake_creator()
+                    raise
+                break
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            self._stats['waits'] += 1
+            try:
+                conn = await asyncio.wait_for(waiter, max(0, deadline - loop.time()))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    if waiter.result() is not None:
+                        # Handed a connection just as we gave up: pass it on
+                        await self.release(waiter.result())
+                    else:
+                        # Handed a reserved slot: give it to the next waiter
+                        self._size -= 1
+                        self._wake_creator()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._stats['timeouts'] += 1
+                raise PoolTimeout(f"no connection to {self.db_path!r} "
+                                  f"available after {timeout}s") from None
+            if conn is not None:
+                break
+            # None means a slot was freed and reserved for us: open one
+            try:
+                conn = await self._connect()
+            except BaseException:
+                self._size -= 1
+                self._wake_creator()
+                raise
+            break
+        self._stats['acquired'] += 1
+        return conn
+
+    def _wake_creator(self):
+        # A slot opened up without a connection to hand over: reserve it for
+        # the first waiter and let it open the connection itself.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._size += 1
+                waiter.set_result(None)
+                return
+
+    async def release(self, conn):
+        """Return a connection, rolling back anything left uncommitted."""
+        try:
+            if getattr(conn, 'in_transaction', False):
+                await conn.rollback()
+        except Exception:
+            self._size -= 1
+            await self._close_quietly(conn)
+            self._wake_creator()
+            return
+        if self._closed:
+            self._size -= 1
+            await self._close_quietly(conn)
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        self._idle.append(conn)
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        """`async with pool.connection() as db:` checkout."""
+        conn = await self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    @staticmethod
+    async def _close_quietly(conn):
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        """Close idle connections now and the rest as they are released."""
+        self._closed = True
+        while self._idle:
+            self._size -= 1
+            await self._close_quietly(self._idle.pop())
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(RuntimeError('connection pool is closed'))
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        snapshot.update(size=self._size, idle=len(self._idle),
+                        waiting=sum(not w.done() for w in self._waiters))
+        return snapshot
+
+
+# Futures belong to one event loop, so pools are kept per loop
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool(db_path='users.db', **kwargs):
+    """Return the running loop's pool for `db_path`, creating it on first
+    use. Keyword arguments only apply when the pool is created.
+    """
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    pool = pools.get(db_path)
+    if pool is None or pool._closed:
+        pool = pools[db_path] = AsyncConnectionPool(db_path, **kwargs)
+    return pool
+
+
+async def close_async_pools():
+    """Close every pool that belongs to the running loop."""
+    pools = _pools.pop(asyncio.get_running_loop(), {})
+    for pool in pools.values():
+        await pool.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import asyncio
+import concurrent.futures
+import sqlite3
+import threading
+
+from connections import connect
+
+
+DEFAULT_CHUNK_SIZE = 500
+_DONE = object()
+
+
+class _Producer(threading.Thread):
+    """Runs one query on its own sqlite3 connection and feeds fetchmany
+    chunks into an asyncio.Queue on the consumer's loop. A full queue
+    blocks the thread, so the query only advances as fast as the consumer.
+    """
+    def __init__(self, loop, queue, query, params, db_path, chunk_size, profile):
+        super().__init__(name='sqlite-stream', daemon=True)
+        self.loop = loop
+        self.queue = queue
+        self.query = query
+        self.params = params
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._pending = None
+        self._conn = None
+
+    def _put(self, item):
+        try:
+            with self._lock:
+                if self._stopped:
+                    return False
+                put = self.queue.put(item)
+                try:
+                    self._pending = asyncio.run_coroutine_threadsafe(
+                        put, self.loop)
+                except RuntimeError:
+                    # Never scheduled: don't leave it un-awaited
+                    put.close()
+                    raise
+            self._pending.result()
+            return True
+        except (concurrent.futures.CancelledError, RuntimeError):
+            # Consumer went away (or its loop closed) while we were blocked
+            return False
+
+    def run(self):
+        try:
+            conn = connect(self.db_path, self.profile, check_same_thread=False)
+        except BaseException as e:
+            self._put(e)
+            return
+        with self._lock:
+            self._conn = conn
+        try:
+            cursor = conn.execute(self.query, self.params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                if not self._put(rows):
+                    return
+            self._put(_DONE)
+        except sqlite3.OperationalError as e:
+            if not self._stopped:
+                self._put(e)
+        except BaseException as e:
+            self._put(e)
+        finally:
+            with self._lock:
+                self._conn = None
+            conn.close()
+
+    def stop(self):
+        """Stop from the loop thread: unblock a pending put and interrupt
+        the statement if it is still running inside SQLite.
+        """
+        with self._lock:
+            self._stopped = True
+            if self._pending is not None:
+                self._pending.cancel()
+            if self._conn is not None:
+                try:
+                    self._conn.interrupt()
+                except sqlite3.ProgrammingError:
+                    pass
+
+
+async def stream_chunks(query, params=(), db_path='users.db',
+                        chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=4,
+                        profile='read_heavy'):
+    """Async generator over the rows of `query` in lists of `chunk_size`.
+
+    The query runs on a dedicated thread. At most `max_chunks` chunks
+    wait between that thread and the event loop, so memory stays bounded
+    however large the result is. If the consumer is cancelled or stops
+    early, the running statement is interrupted and the connection is
+    closed. Use contextlib.aclosing() when breaking out of the loop so
+    this happens at once rather than when the generator is collected.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_chunks)
+    producer = _Producer(loop, queue, query, params, db_path, chunk_size, profile)
+    producer.start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        producer.stop()
+
+
+async def stream_rows(query, params=(), db_path='users.db',
+                      chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=4,
+                      profile='read_heavy'):
+    """Like stream_chunks but yield one row at a time."""
+    chunks = stream_chunks(query, params, db_path, chunk_size, max_chunks, profile)
+    try:
+        async for rows in chunks:
+            for row in rows:
+                yield row
+    finally:
+        await chunks.aclose()
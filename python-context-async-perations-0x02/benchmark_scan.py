@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Single-connection queries against the parallel scan engine on a
+generated users table.
+
+    python3 benchmark_scan.py                         # 1M rows, all cores
+    python3 benchmark_scan.py --rows 5000000 --workers 1 2 4 8
+    python3 benchmark_scan.py --json out.json         # also save results
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from parallel_scan import parallel_aggregate, parallel_scan
+
+
+def setup_database(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, '
+                 'email TEXT, age INTEGER)')
+    conn.executemany('INSERT INTO users (name, email, age) VALUES (?, ?, ?)',
+                     ((f'user{i}', f'user{i}@example.com', 18 + i * 7 % 60)
+                      for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def single(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def build_cases(path):
+    """Return [(name, single-connection call, parallel call(workers, pool))]."""
+    return [
+        ('count age > 40',
+         lambda: single(path, 'SELECT count(*) FROM users WHERE age > ?', (40,)),
+         lambda w, pool: parallel_aggregate(path, 'users', 'count', where='age > ?',
+                                            params=(40,), workers=w, executor=pool)),
+        ('sum(age)',
+         lambda: single(path, 'SELECT sum(age) FROM users'),
+         lambda w, pool: parallel_aggregate(path, 'users', 'sum', 'age',
+                                            workers=w, executor=pool)),
+        ('max(email)',
+         lambda: single(path, 'SELECT max(email) FROM users'),
+         lambda w, pool: parallel_aggregate(path, 'users', 'max', 'email',
+                                            workers=w, executor=pool)),
+        ('count group by age',
+         lambda: single(path, 'SELECT age, count(*) FROM users GROUP BY age'),
+         lambda w, pool: parallel_aggregate(path, 'users', 'count', group_by='age',
+                                            workers=w, executor=pool)),
+        ("filter email LIKE '%99@%'",
+         lambda: single(path, 'SELECT * FROM users WHERE email LIKE ?', ('%99@%',)),
+         lambda w, pool: parallel_scan(path, 'users', 'email LIKE ?', ('%99@%',),
+                                       workers=w, executor=pool)),
+    ]
+
+
+def measure(call, repeat):
+    """Best-of-`repeat` wall time in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users.db')
+        setup_database(path, args.rows)
+        cases = build_cases(path)
+        header = f"{'case':<28}{'single ms':>11}"
+        header += ''.join(f"{f'{w} proc ms':>12}{'speedup':>9}" for w in args.workers)
+        print(header)
+        pools = {w: ProcessPoolExecutor(w) for w in args.workers}
+        try:
+            for name, serial, parallel in cases:
+                baseline = measure(serial, args.repeat)
+                results[name] = {'single': baseline}
+                line = f'{name:<28}{baseline:>11.1f}'
+                for w, pool in pools.items():
+                    # Warm the worker processes so start-up isn't measured
+                    parallel(w, pool)
+                    millis = measure(lambda: parallel(w, pool), args.repeat)
+                    results[name][w] = millis
+                    line += f'{millis:>12.1f}{baseline / millis:>8.2f}x'
+                print(line)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
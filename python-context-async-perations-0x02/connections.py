@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import threading
+import urllib.parse
+from collections import deque
+
+
+# Named PRAGMA bundles. 'default' leaves SQLite's own settings alone.
+PROFILES = {
+    'default': (),
+    # Many concurrent readers: WAL so reads never block on a writer, a big
+    # page cache and memory-mapped reads to skip read() syscalls.
+    'read_heavy': (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -64000),          # ~64 MB (negative = KiB)
+        ('mmap_size', 268435456),        # 256 MB
+        ('temp_store', 'MEMORY'),
+    ),
+    # One-off imports/backfills: no fsyncs at all, so an OS crash or power
+    # loss can lose or corrupt recent writes. Only for data you can reload.
+    'bulk_load': (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'OFF'),
+        ('cache_size', -256000),         # ~256 MB
+        ('mmap_size', 0),
+        ('temp_store', 'MEMORY'),
+    ),
+    # Regular OLTP writes: WAL with fsync at checkpoints only.
+    'balanced': (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -16000),
+        ('mmap_size', 67108864),         # 64 MB
+        ('temp_store', 'DEFAULT'),
+    ),
+    # Frozen, read-only copies (see snapshot_uri): map the whole file so
+    # reads come straight from the OS page cache that every process
+    # sharing the file also uses. SQLite clamps mmap_size to its
+    # compile-time limit (2 GB by default).
+    'snapshot': (
+        ('mmap_size', 2147418112),
+        ('cache_size', -2000),
+        ('temp_store', 'MEMORY'),
+    ),
+}
+
+
+def resolve_profile(profile):
+    """Return (name, pragmas) for a profile name or an iterable of
+    (pragma, value) pairs.
+    """
+    if profile is None:
+        profile = 'default'
+    if isinstance(profile, str):
+        try:
+            return profile, PROFILES[profile]
+        except KeyError:
+            raise ValueError(f"unknown profile {profile!r}; expected one of "
+                             f"{', '.join(sorted(PROFILES))}") from None
+    if isinstance(profile, dict):
+        profile = profile.items()
+    pragmas = tuple(profile)
+    return pragmas, pragmas
+
+
+def apply_profile(conn, pragmas):
+    for name, value in pragmas:
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def snapshot_uri(db_path):
+    """URI that opens `db_path` read-only and immutable: SQLite then takes
+    no locks and never looks for a journal or WAL. Only use it on files
+    that nothing writes to while they are open, such as those written by
+    take_snapshot.
+    """
+    path = urllib.parse.quote(os.path.abspath(db_path))
+    return f'file:{path}?mode=ro&immutable=1'
+
+
+def connect(db_path, profile=None, snapshot=False, **kwargs):
+    """Open a sqlite3 connection to `db_path` configured with `profile`.
+    With snapshot=True the file is opened through snapshot_uri, with the
+    'snapshot' profile unless another one is given.
+    """
+    if snapshot:
+        db_path = snapshot_uri(db_path)
+        kwargs['uri'] = True
+        if profile is None:
+            profile = 'snapshot'
+    _, pragmas = resolve_profile(profile)
+    conn = sqlite3.connect(db_path, **kwargs)
+    try:
+        apply_profile(conn, pragmas)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def take_snapshot(db_path, target_path, pages_per_step=-1):
+    """Copy the live database at `db_path` to `target_path` with the
+    backup API and return `target_path`.
+
+    The copy is consistent: with the default pages_per_step=-1 it is made
+    in one step under a read lock, while smaller steps let writers in
+    between and restart the copy if they change the source. It is written
+    next to the target and renamed over it, so processes reading an older
+    snapshot at that path keep their own file. The copy is switched to a
+    rollback journal so it can be opened immutable without a -wal file.
+    """
+    tmp_path = f'{target_path}.tmp-{os.getpid()}'
+    source = sqlite3.connect(db_path)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target, pages=pages_per_step)
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+class ConnectionCache:
+    """Keeps up to `max_idle` warm connections per (database, profile) so
+    a context manager can skip reconnecting, re-reading the schema and
+    re-applying PRAGMAs. Connections are opened with
+    check_same_thread=False since they may be reused by another thread,
+    but only one user holds a connection at a time.
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'returned': 0, 'closed': 0}
+
+    def get(self, db_path, profile=None, **kwargs):
+        key_profile, _ = resolve_profile(profile)
+        key = (db_path, key_profile, tuple(sorted(kwargs.items())))
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+            self._stats['hits' if conn is not None else 'misses'] += 1
+        if conn is None:
+            conn = connect(db_path, profile, check_same_thread=False, **kwargs)
+        with self._lock:
+            self._keys[id(conn)] = key
+        return conn
+
+    def put(self, conn):
+        """Hand `conn` back; any open transaction is rolled back first."""
+        with self._lock:
+            key = self._keys.pop(id(conn), None)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            key = None
+        with self._lock:
+            idle = self._idle.setdefault(key, deque()) if key else None
+            if idle is not None and len(idle) < self.max_idle:
+                idle.append(conn)
+                self._stats['returned'] += 1
+                return
+            self._stats['closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        with self._lock:
+            idle = [c for conns in self._idle.values() for c in conns]
+            self._idle.clear()
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['idle'] = sum(len(c) for c in self._idle.values())
+        return snapshot
+
+
+connection_cache = ConnectionCache()
+
+
+# Connections currently open by a `with` block, per thread and database, so
+# nested blocks can join them instead of opening their own.
+_active = threading.local()
+
+
+def active_connections():
+    conns = getattr(_active, 'conns', None)
+    if conns is None:
+        conns = _active.conns = {}
+    return conns
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import os
+import re
+import sqlite3
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _identifier(name):
+    # Table and column names are pasted into the SQL, so only allow plain ones
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"invalid identifier {name!r}")
+    return f'"{name}"'
+
+
+def _read_only(db_path):
+    # Quoted like connections.snapshot_uri, so '?', '#' and '%' survive
+    path = urllib.parse.quote(os.path.abspath(db_path))
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    conn.execute('PRAGMA mmap_size = 268435456')
+    return conn
+
+
+def rowid_ranges(db_path, table, partitions):
+    """Split `table` into up to `partitions` inclusive (low, high) rowid
+    ranges of equal width. Empty tables give no ranges.
+    """
+    conn = _read_only(db_path)
+    try:
+        low, high = conn.execute(
+            f'SELECT min(rowid), max(rowid) FROM {_identifier(table)}').fetchone()
+    finally:
+        conn.close()
+    if low is None:
+        return []
+    width = -(-(high - low + 1) // max(1, partitions))
+    return [(start, min(start + width - 1, high))
+            for start in range(low, high + 1, width)]
+
+
+def _scan_sql(table, select, where, group_by=None):
+    sql = f'SELECT {select} FROM {_identifier(table)} WHERE rowid BETWEEN ? AND ?'
+    if where:
+        sql += f' AND ({where})'
+    if group_by:
+        sql += f' GROUP BY {_identifier(group_by)}'
+    return sql
+
+
+def _run_partition(db_path, sql, params, low, high):
+    # Runs in a worker process, on a connection of its own
+    conn = _read_only(db_path)
+    try:
+        return conn.execute(sql, (low, high) + tuple(params)).fetchall()
+    finally:
+        conn.close()
+
+
+def _partials(db_path, sql, params, ranges, workers, executor):
+    if len(ranges) <= 1 or (workers == 1 and executor is None):
+        return [_run_partition(db_path, sql, params, low, high)
+                for low, high in ranges]
+    context = nullcontext(executor) if executor else ProcessPoolExecutor(workers)
+    with context as pool:
+        futures = [pool.submit(_run_partition, db_path, sql, params, low, high)
+                   for low, high in ranges]
+        return [f.result() for f in futures]
+
+
+def _plan(db_path, table, workers, partitions):
+    workers = workers or os.cpu_count() or 1
+    # A few partitions per worker evens out ranges that filter unevenly
+    return workers, rowid_ranges(db_path, table, partitions or workers * 4)
+
+
+def parallel_scan(db_path, table, where=None, params=(), columns='*',
+                  workers=None, partitions=None, executor=None):
+    """Return the rows of `table` matching `where` (SQL with ? params),
+    scanning rowid ranges in parallel worker processes. Rows come back in
+    rowid order. `columns` is '*', one column name or a list of them.
+    Pass `executor` to reuse a ProcessPoolExecutor.
+    """
+    if isinstance(columns, str) and columns != '*':
+        columns = [columns]
+    if columns != '*':
+        columns = ', '.join(_identifier(c) for c in columns)
+    workers, ranges = _plan(db_path, table, workers, partitions)
+    sql = _scan_sql(table, columns, where)
+    rows = []
+    for part in _partials(db_path, sql, params, ranges, workers, executor):
+        rows.extend(part)
+    return rows
+
+
+def _sqlite_order(value):
+    # SQLite orders numbers before text before blobs (NULLs are dropped
+    # before this is used); Python refuses to compare across those types
+    if isinstance(value, (int, float)):
+        return 0, value
+    return (1, value) if isinstance(value, str) else (2, value)
+
+
+def _merge(func, values):
+    values = [v for v in values if v is not None]
+    if func == 'count':
+        return sum(values)
+    if not values:
+        return None
+    if func == 'sum':
+        return sum(values)
+    pick = min if func == 'min' else max
+    return pick(values, key=_sqlite_order)
+
+
+def parallel_aggregate(db_path, table, func, column=None, where=None, params=(),
+                       group_by=None, workers=None, partitions=None,
+                       executor=None):
+    """Compute count/sum/min/max/avg of `column` (count(*) if None) over the
+    rows of `table` matching `where`. Each worker process aggregates its
+    rowid ranges and the partial results are merged here; avg is merged
+    from partial sums and counts. With `group_by`, return a dict of
+    {group value: aggregate}.
+    """
+    func = func.lower()
+    if func not in AGGREGATES:
+        raise ValueError(f"unknown aggregate {func!r}; expected one of "
+                         f"{', '.join(AGGREGATES)}")
+    target = _identifier(column) if column else '*'
+    if func == 'avg':
+        if column is None:
+            raise ValueError('avg needs a column')
+        select = f'sum({target}), count({target})'
+    else:
+        select = f'{func}({target})'
+    if group_by:
+        select = f'{_identifier(group_by)}, {select}'
+
+    workers, ranges = _plan(db_path, table, workers, partitions)
+    sql = _scan_sql(table, select, where, group_by)
+    partials = _partials(db_path, sql, params, ranges, workers, executor)
+
+    def combine(rows):
+        # rows: the partial (value,) or (sum, count) tuples of one group
+        if func != 'avg':
+            return _merge(func, [r[0] for r in rows])
+        total = _merge('sum', [r[0] for r in rows])
+        count = _merge('count', [r[1] for r in rows])
+        return total / count if count else None
+
+    if not group_by:
+        return combine([row for part in partials for row in part])
+    groups = {}
+    for part in partials:
+        for key, *values in part:
+            groups.setdefault(key, []).append(values)
+    return {key: combine(rows) for key, rows in groups.items()}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from connections import connect
+from deadlines import Deadline
+
+
+class ThreadQueryRunner:
+    """Runs sqlite3 reads on a dedicated thread pool for asyncio code.
+
+    Each worker thread opens its own connection on first use and keeps it,
+    so a query never pays for a connect and no connection is shared between
+    threads. Connections use `profile` (WAL by default, so reads run side by
+    side) and are made read-only with PRAGMA query_only. This gives the same
+    coroutine API as the aiosqlite helpers without the extra dependency.
+    """
+    def __init__(self, db_path='users.db', max_workers=4, profile='read_heavy'):
+        self.db_path = db_path
+        self.profile = profile
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='sqlite-reader')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only this thread queries it; close() runs on the caller's thread
+            conn = connect(self.db_path, self.profile, check_same_thread=False)
+            conn.execute('PRAGMA query_only = ON')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _fetchall(self, query, params, deadline, running):
+        conn = self._connection()
+        with self._lock:
+            running.append(conn)
+        try:
+            with Deadline(conn, deadline):
+                cursor = conn.execute(query, params)
+                try:
+                    return cursor.fetchall()
+                finally:
+                    cursor.close()
+        finally:
+            with self._lock:
+                running.clear()
+
+    async def fetchall(self, query, params=(), deadline=None):
+        """Run `query` on a worker thread and return all rows.
+
+        With deadline=seconds the statement is interrupted after that long
+        and deadlines.QueryTimeout is raised. Cancelling the awaiting task
+        interrupts the statement too, instead of leaving it to finish on
+        the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        # Holds the worker's connection while the statement runs
+        running = []
+        try:
+            return await loop.run_in_executor(self._executor, self._fetchall,
+                                              query, params, deadline, running)
+        except asyncio.CancelledError:
+            with self._lock:
+                if running:
+                    running[0].interrupt()
+            raise
+
+    def close(self):
+        """Wait for running queries, then close every worker's connection."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_runner(db_path='users.db', **kwargs):
+    """Return the process-wide runner for `db_path`, creating it on first
+    use. Keyword arguments only apply when the runner is created.
+    """
+    with _runners_lock:
+        runner = _runners.get(db_path)
+        if runner is None:
+            runner = _runners[db_path] = ThreadQueryRunner(db_path, **kwargs)
+        return runner
+
+
+def close_runners():
+    """Close and forget every runner created through get_runner."""
+    with _runners_lock:
+        runners = list(_runners.values())
+        _runners.clear()
+    for runner in runners:
+        runner.close()
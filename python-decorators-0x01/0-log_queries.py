@@ -1,43 +1,140 @@
 import sqlite3
 import functools
-from datetime import datetime
+import inspect
+import time
+
+from columnar import ColumnarResult
+from query_log import QueryLog, caller_site
+from result_cache import query_position
+from streaming import DEFAULT_BATCH_SIZE, iter_rows
 
 #### decorator to lof SQL queries
 
-def log_queries():
-    """Decorator factory that returns a decorator which logs the SQL query
-    passed to the wrapped function (either as a positional or keyword arg
-    named 'query'). It prints the query before calling the function.
+# Shared instrumentation: latency histograms per query fingerprint plus a
+# background writer for the structured records.
+query_log = QueryLog(sample_rate=1.0, slow_threshold=0.1, db_path='users.db')
+
+
+def _row_count(result):
+    if isinstance(result, (list, tuple, ColumnarResult)):
+        return len(result)
+    rowcount = getattr(result, 'rowcount', None)
+    return rowcount if isinstance(rowcount, int) and rowcount >= 0 else None
+
+
+def _find_query(args, kwargs, position=None):
+    """Return (query, params) from the call arguments. The query is the
+    'query' kwarg, the argument at `position` (the 'query' parameter's
+    index, resolved once per decorated function) or else the first
+    positional str that starts with a SQL verb; params are the 'params'
+    kwarg or the tuple/list/dict right after it.
+    """
+    # Try to find the SQL query in kwargs first, then in positional args
+    query = kwargs.get('query')
+    params = kwargs.get('params')
+    if query is None and position is not None and position < len(args) and \
+            isinstance(args[position], str):
+        query = args[position]
+        if params is None and position + 1 < len(args) and \
+                isinstance(args[position + 1], (tuple, list, dict)):
+            params = args[position + 1]
+    if query is None:
+        # Heuristic: find first str-looking arg that starts with a SQL verb
+        for i, a in enumerate(args):
+            if isinstance(a, str):
+                q = a.strip().lower()
+                if q.startswith(('select', 'insert', 'update', 'delete', 'with')):
+                    query = a
+                    if params is None and i + 1 < len(args) and \
+                            isinstance(args[i + 1], (tuple, list, dict)):
+                        params = args[i + 1]
+                    break
+    return query, params
+
+
+def log_queries(log=None):
+    """Decorator factory that returns a decorator which instruments the SQL
+    query passed to the wrapped function (either as a positional or keyword
+    arg named 'query'). The call is timed and a structured record (query
+    fingerprint, params hash, duration, row count, caller) is handed to the
+    QueryLog `log` (the module-level `query_log` by default), which writes it
+    from a background thread instead of the call path.
+    For generator functions the record covers the whole iteration and
+    counts the rows actually yielded.
     """
     def decorator(func):
+        position = query_position(func)
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                query, params = _find_query(args, kwargs, position)
+                if query is None:
+                    return (yield from func(*args, **kwargs))
+
+                target = log or query_log
+                caller = caller_site()
+                rows = 0
+                error = None
+                start = time.perf_counter()
+                try:
+                    for row in func(*args, **kwargs):
+                        rows += 1
+                        yield row
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    # Also reached when the consumer stops early
+                    target.record(query, params, time.perf_counter() - start,
+                                  rows, caller, error)
+            return gen_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # Try to find the SQL query in kwargs first, then in positional args
-            query = kwargs.get('query')
+            query, params = _find_query(args, kwargs, position)
             if query is None:
-                # Heuristic: find first str-looking arg that starts with a SQL verb
-                for a in args:
-                    if isinstance(a, str):
-                        q = a.strip().lower()
-                        if q.startswith(('select', 'insert', 'update', 'delete', 'with')):
-                            query = a
-                            break
-            if query is not None:
-                print(f"Executing SQL query: {query}")
-            else:
-                print("Executing function (no SQL query found in args)")
-            return func(*args, **kwargs)
+                return func(*args, **kwargs)
+
+            target = log or query_log
+            caller = caller_site()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                target.record(query, params, time.perf_counter() - start,
+                              caller=caller, error=e)
+                raise
+            target.record(query, params, time.perf_counter() - start,
+                          _row_count(result), caller)
+            return result
         return wrapper
     return decorator
 
 @log_queries()
-def fetch_all_users(query):
+def fetch_all_users(query, columnar=False):
     conn = sqlite3.connect('users.db')
     cursor = conn.cursor()
     cursor.execute(query)
-    results = cursor.fetchall()
+    # columnar=True returns a compact ColumnarResult instead of tuples
+    results = ColumnarResult.from_cursor(cursor) if columnar else cursor.fetchall()
     conn.close()
     return results
 
-#### fetch users while logging the query
-users = fetch_all_users(query="SELECT * FROM users")
\ No newline at end of file
+
+@log_queries()
+def stream_all_users(query, batch_size=DEFAULT_BATCH_SIZE):
+    """Streaming variant of fetch_all_users: yield rows `batch_size` at a
+    time, keeping the connection open only while the generator runs.
+    """
+    conn = sqlite3.connect('users.db')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        yield from iter_rows(cursor, batch_size)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    #### fetch users while logging the query
+    users = fetch_all_users(query="SELECT * FROM users")
\ No newline at end of file
@@ -1,20 +1,37 @@
-import sqlite3 
 import functools
+import inspect
 
-def with_db_connection(func):
-    """Decorator that opens a sqlite3 connection (to 'users.db'),
-    injects it as the first positional argument to the wrapped function
-    and ensures the connection is closed after the call.
+from bulk import select_in
+from db_pool import get_pool
+from deadlines import Deadline
+
+
+def with_db_connection(func=None, *, deadline=None):
+    """Decorator that checks a sqlite3 connection (to 'users.db') out of
+    the shared pool, injects it as the first positional argument to the
+    wrapped function and returns it to the pool after the call.
+    Generator functions keep the connection checked out for as long as
+    the generator is being iterated and give it back when it finishes or
+    is closed.
+    With deadline=seconds, a statement still running that long after the
+    connection was checked out is interrupted and QueryTimeout is raised.
     """
+    if func is None:
+        return functools.partial(with_db_connection, deadline=deadline)
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
+                yield from func(conn, *args, **kwargs)
+
+        return gen_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
+        with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
             # If the wrapped function already expects conn as first arg,
             # call it with conn prepended to positional args.
             return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
 
     return wrapper
 
@@ -24,7 +41,20 @@ def get_user_by_id(conn, user_id):
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     return cursor.fetchone()
 
-#### Fetch user by ID with automatic connection handling
 
-user = get_user_by_id(user_id=1)
-print(user)
\ No newline at end of file
+@with_db_connection
+def get_users_by_ids(conn, user_ids, chunk_size=None):
+    """Bulk counterpart of get_user_by_id: fetch many users with chunked
+    `WHERE id IN (...)` lookups sized to SQLite's variable limit.
+    Return {user_id: row}; ids that don't exist are left out.
+    """
+    # dict.fromkeys drops duplicate ids but keeps their order
+    ids = list(dict.fromkeys(user_ids))
+    rows = select_in(conn, "SELECT * FROM users WHERE id IN {in}", ids, chunk_size)
+    return {row[0]: row for row in rows}
+
+if __name__ == '__main__':
+    #### Fetch user by ID with automatic connection handling
+
+    user = get_user_by_id(user_id=1)
+    print(user)
\ No newline at end of file
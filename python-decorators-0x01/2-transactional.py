@@ -1,36 +1,93 @@
-import sqlite3 
 import functools
-def with_db_connection(func):
-	"""Open a sqlite3 connection to 'users.db', pass it as the first
-	argument to the wrapped function and ensure it's closed afterwards.
+from contextlib import contextmanager
+
+from bulk import execute_many
+from db_pool import get_pool
+from deadlines import Deadline
+from transactions import (active_connection, default_committer, depth,
+	savepoint, scope)
+
+
+def with_db_connection(func=None, *, deadline=None):
+	"""Check a pooled sqlite3 connection to 'users.db' out, pass it as the
+	first argument to the wrapped function and return it to the pool
+	afterwards.
+	With deadline=seconds, a statement still running that long after the
+	connection was checked out is interrupted and QueryTimeout is raised.
+
+	For @transactional(group_commit=...) functions only the caller that
+	leads a batch checks a connection out; the others wait without one.
+
+	Called from inside a transaction already open in this thread, it
+	passes that transaction's connection on instead of checking another
+	one out, so a nested @transactional call becomes a savepoint of the
+	outer transaction (and bypasses group commit).
 	"""
+	if func is None:
+		return functools.partial(with_db_connection, deadline=deadline)
+	committer = getattr(func, 'group_committer', None)
+
+	@contextmanager
+	def checkout():
+		with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
+			yield conn
+
 	@functools.wraps(func)
 	def wrapper(*args, **kwargs):
-		conn = sqlite3.connect('users.db')
-		try:
+		conn = active_connection()
+		if conn is not None:
+			with Deadline(conn, deadline):
+				return func(conn, *args, **kwargs)
+		if committer is not None:
+			return committer.submit_with(checkout, func.__wrapped__, *args, **kwargs)
+		with checkout() as conn:
 			return func(conn, *args, **kwargs)
-		finally:
-			conn.close()
 
 	return wrapper
 
 
-def transactional(func):
+def transactional(func=None, *, group_commit=None):
 	"""Decorator that wraps a DB operation in a transaction. The wrapped
 	function is expected to accept a sqlite3 connection as its first
 	positional argument. On success commit; on exception rollback and
 	re-raise the exception.
+
+	A transactional call made while another one is already open on the
+	same connection runs in a SAVEPOINT instead, so only its own work is
+	undone if it fails and the outer call decides when to commit.
+
+	@transactional(group_commit=True) (or a GroupCommitter instance) opts
+	into group commit: concurrent top-level calls are batched into one
+	transaction and one commit, each in its own savepoint.
 	"""
+	if func is None:
+		return functools.partial(transactional, group_commit=group_commit)
+	committer = default_committer if group_commit is True else group_commit
+
 	@functools.wraps(func)
 	def wrapper(conn, *args, **kwargs):
+		level = depth(conn)
+		if level:
+			with scope(conn), savepoint(conn, f'transactional_{level}'):
+				return func(conn, *args, **kwargs)
+
+		if committer:
+			return committer.submit(conn, func, *args, **kwargs)
+
 		try:
-			result = func(conn, *args, **kwargs)
+			if not conn.in_transaction:
+				# Begin explicitly so nested savepoints join this transaction
+				conn.execute('BEGIN')
+			with scope(conn):
+				result = func(conn, *args, **kwargs)
 			conn.commit()
 			return result
 		except Exception:
 			conn.rollback()
 			raise
 
+	# Lets with_db_connection submit to the committer without a connection
+	wrapper.group_committer = committer or None
 	return wrapper
 
 @with_db_connection
@@ -39,6 +96,18 @@ def update_user_email(conn, user_id, new_email):
 	cursor = conn.cursor()
 	cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
 
-#### Update user's email with automatic transaction handling
 
-update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
\ No newline at end of file
+@with_db_connection
+@transactional
+def update_user_emails(conn, pairs):
+	"""Bulk counterpart of update_user_email: apply every (user_id, new_email)
+	pair with a single executemany inside one transaction. `pairs` may be a
+	generator. Return the number of rows updated.
+	"""
+	return execute_many(conn, "UPDATE users SET email = ? WHERE id = ?",
+			((new_email, user_id) for user_id, new_email in pairs))
+
+if __name__ == '__main__':
+	#### Update user's email with automatic transaction handling
+
+	update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
\ No newline at end of file
@@ -1,57 +1,199 @@
 import time
-import sqlite3 
+import asyncio
+import inspect
 import functools
 
+from columnar import ColumnarResult
+from db_pool import get_pool
+from deadlines import Deadline
+from retry_policy import RetryStats, decorrelated_jitter, default_budget, is_transient
+from streaming import DEFAULT_BATCH_SIZE, iter_rows
+
 #### paste your with_db_decorator here
 
-def with_db_connection(func):
-	"""Open a sqlite3 connection to 'users.db', pass it as the first
-	argument to the wrapped function and ensure it's closed afterwards.
+def with_db_connection(func=None, *, deadline=None):
+	"""Check a pooled sqlite3 connection to 'users.db' out, pass it as the
+	first argument to the wrapped function and return it to the pool
+	afterwards.
+	Generator functions keep the connection checked out for as long as
+	the generator is being iterated and give it back when it finishes or
+	is closed.
+	With deadline=seconds, a statement still running that long after the
+	connection was checked out is interrupted and QueryTimeout is raised.
 	"""
+	if func is None:
+		return functools.partial(with_db_connection, deadline=deadline)
+	if inspect.isgeneratorfunction(func):
+		@functools.wraps(func)
+		def gen_wrapper(*args, **kwargs):
+			with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
+				yield from func(conn, *args, **kwargs)
+
+		return gen_wrapper
+
 	@functools.wraps(func)
 	def wrapper(*args, **kwargs):
-		conn = sqlite3.connect('users.db')
-		try:
+		with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
 			return func(conn, *args, **kwargs)
-		finally:
-			conn.close()
 
 	return wrapper
 
 
-def retry_on_failure(retries=3, delay=2):
+def retry_on_failure(retries=3, delay=2, max_delay=30, retry_on=is_transient,
+		budget=default_budget):
 	"""Decorator factory that retries the wrapped function up to `retries`
-	times when it raises an exception. Sleeps `delay` seconds between attempts.
+	times when it raises a transient error (`retry_on(exc)` is true, by
+	default SQLite "database is locked" and friends). Other errors are
+	re-raised at once. Sleeps follow decorrelated-jitter exponential backoff
+	starting at `delay` seconds and capped at `max_delay`, and every retry
+	must be allowed by the shared RetryBudget so retries can't multiply load
+	when the database is struggling. Counters are exposed as `.stats`.
+	Generator functions are retried only until their first row has been
+	yielded; a failure after that is re-raised.
 	The wrapped function is expected to accept a sqlite3 connection as its
 	first argument when used together with `with_db_connection`.
 	"""
 	def decorator(func):
+		stats = RetryStats()
+
+		def should_retry(e, attempt):
+			# Record the failure and decide whether another attempt is allowed
+			if not retry_on(e):
+				stats.add(failures=1, not_retryable=1)
+				return False
+			if budget is not None:
+				budget.record_failure()
+			if attempt == retries:
+				# Exhausted retries — re-raise
+				stats.add(failures=1)
+				return False
+			if budget is not None and not budget.can_retry():
+				stats.add(failures=1, budget_exhausted=1)
+				return False
+			return True
+
+		def succeeded():
+			stats.add(successes=1)
+			if budget is not None:
+				budget.record_success()
+
+		if inspect.iscoroutinefunction(func):
+			@functools.wraps(func)
+			async def async_wrapper(*args, **kwargs):
+				stats.add(calls=1)
+				sleep = delay
+				for attempt in range(1, retries + 1):
+					stats.add(attempts=1)
+					try:
+						result = await func(*args, **kwargs)
+					except Exception as e:
+						if not should_retry(e, attempt):
+							raise
+					else:
+						succeeded()
+						return result
+					sleep = decorrelated_jitter(delay, max_delay, sleep)
+					stats.add(retries=1, backoff_seconds=sleep)
+					await asyncio.sleep(sleep)
+
+			async_wrapper.stats = stats
+			return async_wrapper
+
+		if inspect.isgeneratorfunction(func):
+			@functools.wraps(func)
+			def gen_wrapper(*args, **kwargs):
+				# Retry only while nothing has been yielded: once the caller
+				# has seen rows, starting over would hand them out twice.
+				stats.add(calls=1)
+				sleep = delay
+				for attempt in range(1, retries + 1):
+					stats.add(attempts=1)
+					rows = func(*args, **kwargs)
+					yielded = False
+					try:
+						while True:
+							try:
+								row = next(rows)
+							except StopIteration:
+								succeeded()
+								return
+							except Exception as e:
+								if yielded:
+									stats.add(failures=1)
+									raise
+								if not should_retry(e, attempt):
+									raise
+								break
+							yielded = True
+							yield row
+					finally:
+						rows.close()
+					sleep = decorrelated_jitter(delay, max_delay, sleep)
+					stats.add(retries=1, backoff_seconds=sleep)
+					time.sleep(sleep)
+
+			gen_wrapper.stats = stats
+			return gen_wrapper
+
 		@functools.wraps(func)
 		def wrapper(*args, **kwargs):
-			last_exc = None
+			stats.add(calls=1)
+			sleep = delay
 			for attempt in range(1, retries + 1):
+				stats.add(attempts=1)
 				try:
-					return func(*args, **kwargs)
+					result = func(*args, **kwargs)
 				except Exception as e:
-					last_exc = e
-					if attempt == retries:
-						# Exhausted retries — re-raise
+					if not should_retry(e, attempt):
 						raise
-					time.sleep(delay)
+				else:
+					succeeded()
+					return result
+				sleep = decorrelated_jitter(delay, max_delay, sleep)
+				stats.add(retries=1, backoff_seconds=sleep)
+				time.sleep(sleep)
 
+		wrapper.stats = stats
 		return wrapper
 
 	return decorator
 
+
+def async_retry_on_failure(retries=3, delay=2, max_delay=30, retry_on=is_transient,
+		budget=default_budget):
+	"""Same as retry_on_failure but insists on a coroutine function; the
+	backoff sleeps use asyncio.sleep so the event loop keeps running.
+	"""
+	def decorator(func):
+		if not inspect.iscoroutinefunction(func):
+			raise TypeError(f"{func.__qualname__} is not a coroutine function")
+		return retry_on_failure(retries, delay, max_delay, retry_on, budget)(func)
+
+	return decorator
+
 @with_db_connection
 @retry_on_failure(retries=3, delay=1)
-def fetch_users_with_retry(conn):
+def fetch_users_with_retry(conn, columnar=False):
 	cursor = conn.cursor()
 	cursor.execute("SELECT * FROM users")
+	if columnar:
+		return ColumnarResult.from_cursor(cursor)
 	return cursor.fetchall()
 
 
-#### attempt to fetch users with automatic retry on failure
+@with_db_connection
+@retry_on_failure(retries=3, delay=1)
+def stream_users_with_retry(conn, batch_size=DEFAULT_BATCH_SIZE):
+	"""Streaming variant of fetch_users_with_retry: yield users one at a
+	time, fetched `batch_size` rows at a time.
+	"""
+	cursor = conn.cursor()
+	cursor.execute("SELECT * FROM users")
+	yield from iter_rows(cursor, batch_size)
+
+
+if __name__ == '__main__':
+	#### attempt to fetch users with automatic retry on failure
 
-users = fetch_users_with_retry()
-print(users)
\ No newline at end of file
+	users = fetch_users_with_retry()
+	print(users)
\ No newline at end of file
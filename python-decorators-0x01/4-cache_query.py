@@ -1,67 +1,182 @@
-import time
-import sqlite3 
 import functools
+import inspect
 
+from columnar import ColumnarResult
+from db_pool import get_pool
+from deadlines import Deadline
+from result_cache import (QueryCache, make_key, query_position, statement_kind,
+                          tables_read, tables_written)
+from singleflight import AsyncSingleFlight, SingleFlight
 
-query_cache = {}
 
+# Bounded LRU of query results; entries are dropped when a write to one of
+# the tables they read goes through cache_query.
+query_cache = QueryCache(max_entries=256, ttl=None)
+_MISS = object()
 
-def with_db_connection(func):
-    """Open a sqlite3 connection to 'users.db', pass it as the first
-    argument to the wrapped function and ensure it's closed afterwards.
+
+def with_db_connection(func=None, *, deadline=None):
+    """Check a pooled sqlite3 connection to 'users.db' out, pass it as the
+    first argument to the wrapped function and return it to the pool
+    afterwards.
+    Generator functions keep the connection checked out for as long as
+    the generator is being iterated and give it back when it finishes or
+    is closed.
+    With deadline=seconds, a statement still running that long after the
+    connection was checked out is interrupted and QueryTimeout is raised.
     """
+    if func is None:
+        return functools.partial(with_db_connection, deadline=deadline)
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
+                yield from func(conn, *args, **kwargs)
+
+        return gen_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('users.db')
-        try:
+        with get_pool('users.db').connection() as conn, Deadline(conn, deadline):
             return func(conn, *args, **kwargs)
-        finally:
-            conn.close()
 
     return wrapper
 
 
-def cache_query(func):
-    """Decorator that caches results of functions that execute SQL queries.
-    It finds the SQL query string either from the 'query' kwarg or by
+def _find_query(args, kwargs, position=None):
+    """Find the SQL query string from the 'query' kwarg, from the argument
+    at `position` (resolved once from the function signature) or by
     scanning positional args for a string starting with a SQL verb.
     """
+    query = kwargs.get('query')
+    if query is None and position is not None and position < len(args) and \
+            isinstance(args[position], str):
+        return args[position]
+    if query is None:
+        for a in args:
+            if isinstance(a, str):
+                q = a.strip().lower()
+                if q.startswith(('select', 'insert', 'update', 'delete', 'with')):
+                    query = a
+                    break
+    return query
+
+
+def cache_query(func=None, *, single_flight=False):
+    """Decorator that caches results of functions that execute SQL queries.
+    Results are keyed by the normalized SQL plus the other call arguments,
+    and an INSERT/UPDATE/DELETE evicts cached reads of the tables it touches.
+
+    Use it bare (@cache_query) or as @cache_query(single_flight=True): in
+    single-flight mode concurrent misses for the same key run the query once
+    and share its result. Coroutine functions get an async wrapper whose
+    single-flight mode coalesces tasks instead of threads. Generator
+    functions are returned unchanged since streamed results aren't cached.
+    """
+    if func is None:
+        return functools.partial(cache_query, single_flight=single_flight)
+    if inspect.isgeneratorfunction(func):
+        # A stream is consumed once and may be huge: never cache it
+        return func
+    position = query_position(func)
+
+    def load(key, query, args, kwargs):
+        # Another caller may have filled the entry while we waited to lead
+        result = query_cache.get(key, _MISS)
+        if result is _MISS:
+            tables = tables_read(query)
+            generation = query_cache.generation(tables)
+            result = func(*args, **kwargs)
+            # Not stored if a write to `tables` landed while it ran
+            query_cache.set(key, result, tables, generation=generation)
+        return result
+
+    async def load_async(key, query, args, kwargs):
+        result = query_cache.get(key, _MISS)
+        if result is _MISS:
+            tables = tables_read(query)
+            generation = query_cache.generation(tables)
+            result = await func(*args, **kwargs)
+            query_cache.set(key, result, tables, generation=generation)
+        return result
+
+    if inspect.iscoroutinefunction(func):
+        flight = AsyncSingleFlight() if single_flight else None
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            query = _find_query(args, kwargs, position)
+            kind = statement_kind(query) if query is not None else None
+            if kind == 'write':
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    query_cache.invalidate_tables(tables_written(query))
+
+            key = make_key(query, args, kwargs) if kind == 'read' else None
+            if key is None:
+                return await func(*args, **kwargs)
+
+            result = query_cache.get(key, _MISS)
+            if result is not _MISS:
+                return result
+            if flight is None:
+                tables = tables_read(query)
+                generation = query_cache.generation(tables)
+                result = await func(*args, **kwargs)
+                query_cache.set(key, result, tables, generation=generation)
+                return result
+            return await flight.do(key, load_async, key, query, args, kwargs)
+
+        async_wrapper.flight = flight
+        return async_wrapper
+
+    flight = SingleFlight() if single_flight else None
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Locate query string
-        query = kwargs.get('query')
-        if query is None:
-            for a in args:
-                if isinstance(a, str):
-                    q = a.strip().lower()
-                    if q.startswith(('select', 'insert', 'update', 'delete', 'with')):
-                        query = a
-                        break
-
-        if query is None:
+        query = _find_query(args, kwargs, position)
+        kind = statement_kind(query) if query is not None else None
+        if kind == 'write':
+            # Evict stale reads even if the write fails half way through
+            try:
+                return func(*args, **kwargs)
+            finally:
+                query_cache.invalidate_tables(tables_written(query))
+
+        key = make_key(query, args, kwargs) if kind == 'read' else None
+        if key is None:
             # Nothing to cache on — just call through
             return func(*args, **kwargs)
 
-        # Use the query string as the cache key
-        if query in query_cache:
+        result = query_cache.get(key, _MISS)
+        if result is not _MISS:
             # Optionally, we could return a copy if results are mutable
-            return query_cache[query]
-
-        result = func(*args, **kwargs)
-        query_cache[query] = result
-        return result
+            return result
+        if flight is None:
+            tables = tables_read(query)
+            generation = query_cache.generation(tables)
+            result = func(*args, **kwargs)
+            query_cache.set(key, result, tables, generation=generation)
+            return result
+        return flight.do(key, load, key, query, args, kwargs)
 
+    wrapper.flight = flight
     return wrapper
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, columnar=False):
     cursor = conn.cursor()
     cursor.execute(query)
+    # Cached ColumnarResults take a fraction of the memory of tuple lists
+    if columnar:
+        return ColumnarResult.from_cursor(cursor)
     return cursor.fetchall()
 
-#### First call will cache the result
-users = fetch_users_with_cache(query="SELECT * FROM users")
+if __name__ == '__main__':
+    #### First call will cache the result
+    users = fetch_users_with_cache(query="SELECT * FROM users")
 
-#### Second call will use the cached result
-users_again = fetch_users_with_cache(query="SELECT * FROM users")
\ No newline at end of file
+    #### Second call will use the cached result
+    users_again = fetch_users_with_cache(query="SELECT * FROM users")
\ No newline at end of file
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Per-call overhead of the query decorators, alone and stacked, against
+an in-memory copy of the users table.
+
+    python3 benchmark_decorators.py                   # print the table
+    python3 benchmark_decorators.py --json out.json   # also save results
+    python3 benchmark_decorators.py --compare out.json --threshold 15
+                                                      # flag regressions
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import timeit
+
+from db_pool import ConnectionPool, set_pool
+from fast_path import fused
+from query_log import QueryLog
+from result_cache import QueryCache
+from retry_policy import RetryBudget
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MEMORY_URI = 'file:benchmark_users?mode=memory&cache=shared'
+QUERY = "SELECT * FROM users WHERE id = ?"
+
+
+def load(name):
+    """Import one of the numbered task files (not valid module names)."""
+    spec = importlib.util.spec_from_file_location(
+        name.replace('-', '_'), os.path.join(HERE, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def setup_database(rows):
+    """Create the shared in-memory users table and route the decorators'
+    'users.db' pool to it. Return a connection that keeps it alive.
+    """
+    keeper = sqlite3.connect(MEMORY_URI, uri=True, check_same_thread=False)
+    keeper.execute('DROP TABLE IF EXISTS users')
+    keeper.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, '
+                   'email TEXT, age INTEGER)')
+    keeper.executemany('INSERT INTO users (name, email, age) VALUES (?, ?, ?)',
+                       ((f'user{i}', f'user{i}@example.com', 18 + i % 60)
+                        for i in range(rows)))
+    keeper.commit()
+    set_pool('users.db', ConnectionPool(MEMORY_URI, max_size=2, uri=True,
+                                        pragmas=()))
+    return keeper
+
+
+def lookup(conn, query, params):
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def build_cases(conn):
+    """Return [(name, zero-argument callable)] for every measured case."""
+    m0 = load('0-log_queries')
+    m1 = load('1-with_db_connection')
+    m2 = load('2-transactional')
+    m3 = load('3-retry_on_failure')
+    m4 = load('4-cache_query')
+    # Quiet, never-slow log and a budget that can't run dry, so only the
+    # bookkeeping itself is measured.
+    log = QueryLog(sink=lambda record: None, sample_rate=0.0, slow_threshold=None)
+    budget = RetryBudget(max_tokens=10 ** 9)
+    m4.query_cache = QueryCache(max_entries=1024)
+    params = (1,)
+
+    logged = m0.log_queries(log)(lookup)
+    cached = m4.cache_query(lookup)
+    retried = m3.retry_on_failure(retries=3, delay=0.01, budget=budget)(lookup)
+    transacted = m2.transactional(lookup)
+    connected = m1.with_db_connection(lookup)
+    cache_stack = m4.with_db_connection(m4.cache_query(lookup))
+    retry_stack = m3.with_db_connection(
+        m3.retry_on_failure(retries=3, delay=0.01, budget=budget)(lookup))
+    tx_stack = m2.with_db_connection(m2.transactional(lookup))
+    full_stack = m0.log_queries(log)(m3.with_db_connection(
+        m3.retry_on_failure(retries=3, delay=0.01, budget=budget)(
+            m4.cache_query(lookup))))
+
+    fused_cache = fused(lookup, cache=QueryCache(max_entries=1024))
+    fused_retry = fused(lookup, retries=3, delay=0.01, budget=budget)
+    fused_tx = fused(lookup, transaction=True)
+    fused_full = fused(lookup, log=log, cache=QueryCache(max_entries=1024),
+                       retries=3, delay=0.01, budget=budget)
+
+    return [
+        ('raw (held connection)', lambda: lookup(conn, QUERY, params)),
+        ('log_queries', lambda: logged(conn, QUERY, params)),
+        ('cache_query (hit)', lambda: cached(conn, QUERY, params)),
+        ('retry_on_failure', lambda: retried(conn, QUERY, params)),
+        ('transactional', lambda: transacted(conn, QUERY, params)),
+        ('with_db_connection', lambda: connected(QUERY, params)),
+        ('stack: connection+cache (hit)', lambda: cache_stack(QUERY, params)),
+        ('fused: connection+cache (hit)', lambda: fused_cache(QUERY, params)),
+        ('stack: connection+retry', lambda: retry_stack(QUERY, params)),
+        ('fused: connection+retry', lambda: fused_retry(QUERY, params)),
+        ('stack: connection+transactional', lambda: tx_stack(QUERY, params)),
+        ('fused: connection+transactional', lambda: fused_tx(QUERY, params)),
+        ('stack: log+connection+retry+cache', lambda: full_stack(QUERY, params)),
+        ('fused: log+connection+retry+cache', lambda: fused_full(QUERY, params)),
+    ]
+
+
+def measure(call, number, repeat):
+    """Best-of-`repeat` time per call in microseconds."""
+    call()  # warm caches and the pool
+    timings = timeit.Timer(call).repeat(repeat=repeat, number=number)
+    return min(timings) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--number', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    keeper = setup_database(args.rows)
+    conn = sqlite3.connect(MEMORY_URI, uri=True)
+    results = {}
+    for name, call in build_cases(conn):
+        results[name] = measure(call, args.number, args.repeat)
+
+    baseline = results['raw (held connection)']
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    regressions = []
+    print(f"{'case':<36}{'us/call':>10}{'overhead':>11}{'vs prev':>10}")
+    for name, micros in results.items():
+        line = f'{name:<36}{micros:>10.2f}{micros - baseline:>+11.2f}'
+        if name in previous:
+            change = (micros - previous[name]) / previous[name] * 100
+            line += f'{change:>+9.1f}%'
+            if change > args.threshold:
+                regressions.append(name)
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    conn.close()
+    keeper.close()
+    if regressions:
+        print(f"regressions over {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import sqlite3
+from itertools import islice
+
+
+# Compile-time default of SQLITE_MAX_VARIABLE_NUMBER before SQLite 3.32.
+DEFAULT_VARIABLE_LIMIT = 999
+
+
+def variable_limit(conn):
+    """Return how many '?' parameters one statement may bind on `conn`."""
+    limit_id = getattr(sqlite3, 'SQLITE_LIMIT_VARIABLE_NUMBER', None)
+    if limit_id is not None:
+        try:
+            return conn.getlimit(limit_id)
+        except (AttributeError, sqlite3.Error):
+            pass
+    return DEFAULT_VARIABLE_LIMIT
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def select_in(conn, query, values, chunk_size=None):
+    """Run `query` once per chunk of `values`, replacing its single '{in}'
+    placeholder with a '(?, ?, ...)' list, and yield the resulting rows.
+
+    Chunks are sized to the connection's variable limit. Every full chunk
+    produces the same SQL text, so sqlite3's statement cache prepares it
+    only once.
+    """
+    size = min(chunk_size or variable_limit(conn), variable_limit(conn))
+    full_sql = None
+    cursor = conn.cursor()
+    try:
+        for chunk in chunked(values, size):
+            if len(chunk) == size:
+                if full_sql is None:
+                    full_sql = query.replace('{in}', '(' + ', '.join('?' * size) + ')')
+                sql = full_sql
+            else:
+                sql = query.replace('{in}', '(' + ', '.join('?' * len(chunk)) + ')')
+            cursor.execute(sql, chunk)
+            yield from cursor
+    finally:
+        cursor.close()
+
+
+def execute_many(conn, query, rows):
+    """executemany `query` over `rows` and return the number of rows
+    changed. `rows` may be a generator; sqlite3 consumes it lazily, so
+    millions of rows never have to be held in memory at once.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(query, rows)
+        return cursor.rowcount
+    finally:
+        cursor.close()
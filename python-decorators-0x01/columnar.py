@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TextColumn:
+    """Read-only sequence of str (or bytes) values stored back to back in
+    one buffer, with array('q') offsets marking where each value starts
+    and an optional bytearray flagging NULLs, which read as None.
+    Slicing returns a view on the same buffer.
+    """
+    def __init__(self, data, offsets, start=0, stop=None, binary=False,
+                 nulls=None):
+        self._data = data
+        self._offsets = offsets
+        self._start = start
+        self._stop = len(offsets) - 1 if stop is None else stop
+        self.binary = binary
+        self._nulls = nulls
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _value(self, i):
+        if self._nulls is not None and self._nulls[i]:
+            return None
+        raw = self._data[self._offsets[i]:self._offsets[i + 1]]
+        return bytes(raw) if self.binary else raw.decode('utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return TextColumn(self._data, self._offsets, self._start + start,
+                              self._start + stop, self.binary, self._nulls)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('column index out of range')
+        return self._value(self._start + index)
+
+    def __iter__(self):
+        for i in range(self._start, self._stop):
+            yield self._value(i)
+
+    @property
+    def nbytes(self):
+        used = self._offsets[self._stop] - self._offsets[self._start]
+        return used + (len(self) + 1) * self._offsets.itemsize
+
+
+class _ColumnBuilder:
+    """Accumulates one column, picking the most compact storage that fits
+    the values seen so far: array('q') for ints, array('d') for floats, a
+    text/blob buffer for str/bytes, and a plain list if types are mixed
+    (ints and floats included, so large ints keep their precision).
+    """
+    __slots__ = ('kind', 'values', 'data', 'offsets', 'nulls', 'count')
+
+    def __init__(self):
+        self.kind = None
+        self.values = None
+        self.data = None
+        self.offsets = None
+        self.nulls = None
+        self.count = 0
+
+    def _start(self, value):
+        # Earlier rows were all NULL: back-fill placeholders for them
+        if isinstance(value, bool) or not isinstance(value, (int, float, str, bytes)):
+            self.kind = 'object'
+            self.values = [None] * self.count
+        elif isinstance(value, int):
+            self.kind = 'int'
+            self.values = array('q', bytes(8 * self.count))
+        elif isinstance(value, float):
+            self.kind = 'float'
+            self.values = array('d', bytes(8 * self.count))
+        else:
+            self.kind = 'text' if isinstance(value, str) else 'blob'
+            self.data = bytearray()
+            self.offsets = array('q', bytes(8 * (self.count + 1)))
+
+    def _to_object(self):
+        values = list(self._column())
+        if self.nulls is not None:
+            # Numeric storage holds 0 for NULLs
+            values = [None if null else v for v, null in zip(values, self.nulls)]
+        self.values = values
+        self.kind = 'object'
+        self.data = self.offsets = None
+
+    def _mark_null(self):
+        if self.nulls is None:
+            self.nulls = bytearray(self.count)
+        self.nulls.append(1)
+
+    def append(self, value):
+        if value is None:
+            self._mark_null()
+            if self.kind in ('int', 'float'):
+                self.values.append(0)
+            elif self.kind in ('text', 'blob'):
+                self.offsets.append(len(self.data))
+            elif self.kind == 'object':
+                self.values.append(None)
+            self.count += 1
+            return
+
+        if self.nulls is not None:
+            self.nulls.append(0)
+        if self.kind is None:
+            self._start(value)
+        kind = self.kind
+        if kind == 'int':
+            if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+                self.values.append(value)
+            else:
+                self._to_object()
+                self.values.append(value)
+        elif kind == 'float':
+            if type(value) is float:
+                self.values.append(value)
+            else:
+                self._to_object()
+                self.values.append(value)
+        elif kind == 'text' and isinstance(value, str):
+            self.data += value.encode('utf-8')
+            self.offsets.append(len(self.data))
+        elif kind == 'blob' and isinstance(value, bytes):
+            self.data += value
+            self.offsets.append(len(self.data))
+        else:
+            if kind != 'object':
+                self._to_object()
+            self.values.append(value)
+        self.count += 1
+
+    def _column(self):
+        if self.kind in ('text', 'blob'):
+            return TextColumn(self.data, self.offsets, binary=self.kind == 'blob',
+                              nulls=self.nulls)
+        if self.kind is None:
+            return [None] * self.count
+        return self.values
+
+    def build(self):
+        return self._column(), self.nulls
+
+
+class ColumnarResult:
+    """Query result stored column by column instead of as a list of tuples.
+
+    Numeric columns live in array('q')/array('d'), text in a single UTF-8
+    buffer with offsets, so a result costs roughly the size of its values
+    rather than ~100 bytes of tuple and object overhead per row. Rows are
+    only built as tuples when iterated or indexed; columns can be read
+    directly with column(name) and slices share the underlying storage
+    where possible.
+    """
+    def __init__(self, names, columns, nulls, start=0, stop=None):
+        self.names = tuple(names)
+        self._columns = list(columns)
+        self._nulls = list(nulls)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._start = start
+        if stop is None:
+            stop = len(self._columns[0]) if self._columns else 0
+        self._stop = stop
+
+    @classmethod
+    def from_rows(cls, names, rows):
+        """Build a result from column `names` and an iterable of rows."""
+        builders = [_ColumnBuilder() for _ in names]
+        for row in rows:
+            for builder, value in zip(builders, row):
+                builder.append(value)
+        built = [b.build() for b in builders]
+        return cls(names, [c for c, _ in built], [n for _, n in built])
+
+    @classmethod
+    def from_cursor(cls, cursor, batch_size=1000):
+        """Drain an executed cursor with fetchmany, appending each batch
+        straight into the column builders.
+        """
+        def rows():
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield from batch
+
+        return cls.from_rows([d[0] for d in cursor.description or ()], rows())
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _value(self, col, i):
+        nulls = self._nulls[col]
+        if nulls is not None and nulls[i]:
+            return None
+        return self._columns[col][i]
+
+    def _row(self, i):
+        return tuple(self._value(col, i) for col in range(len(self.names)))
+
+    def __iter__(self):
+        for i in range(self._start, self._stop):
+            yield self._row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return ColumnarResult.from_rows(
+                    self.names, (self[i] for i in range(start, stop, step)))
+            return ColumnarResult(self.names, self._columns, self._nulls,
+                                  self._start + start, self._start + stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('row index out of range')
+        return self._row(self._start + index)
+
+    def column(self, name):
+        """Return the values of column `name` (a name or position). Numeric
+        columns come back as a memoryview over their array and text as a
+        TextColumn view, both without copying; mixed-type columns are
+        copied into a list. NULLs read as 0 in numeric columns (see
+        nulls(name)) and as None elsewhere.
+        """
+        col = self._index[name] if isinstance(name, str) else name
+        values = self._columns[col]
+        if isinstance(values, array):
+            return memoryview(values)[self._start:self._stop]
+        return values[self._start:self._stop]
+
+    def nulls(self, name):
+        """Return a bytearray flagging NULL rows of column `name`, or None
+        if the column has no NULLs.
+        """
+        col = self._index[name] if isinstance(name, str) else name
+        nulls = self._nulls[col]
+        return None if nulls is None else nulls[self._start:self._stop]
+
+    def to_numpy(self, name):
+        """Return a numeric column as a NumPy array sharing its memory.
+        Requires numpy.
+        """
+        if numpy is None:
+            raise RuntimeError('numpy is not installed')
+        col = self._index[name] if isinstance(name, str) else name
+        values = self._columns[col]
+        if not isinstance(values, array):
+            raise TypeError(f'column {name!r} is not numeric')
+        dtype = 'i8' if values.typecode == 'q' else 'f8'
+        return numpy.frombuffer(values, dtype=dtype)[self._start:self._stop]
+
+    def tolist(self):
+        """Materialize the result as the usual list of tuples."""
+        return list(self)
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the stored columns."""
+        total = 0
+        for col, values in enumerate(self._columns):
+            if isinstance(values, array):
+                total += values.itemsize * len(self)
+            elif isinstance(values, TextColumn):
+                total += values[self._start:self._stop].nbytes
+            else:
+                total += sum(sys.getsizeof(v) for v in values[self._start:self._stop])
+                total += 8 * len(self)
+            if self._nulls[col] is not None:
+                total += len(self)
+        return total
+
+    def __eq__(self, other):
+        if isinstance(other, (ColumnarResult, list, tuple)):
+            return len(self) == len(other) and all(
+                a == tuple(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'<ColumnarResult {len(self)} rows x {len(self.names)} columns>'
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# PRAGMAs applied to every new connection. WAL lets readers run alongside a
+# writer and synchronous=NORMAL is the usual pairing for it.
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', 5000),
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the checkout
+    timeout expires.
+    """
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of sqlite3 connections to one database.
+
+    Idle connections are handed out most-recently-used first so the page
+    cache of a warm connection is reused. A checkout blocks for at most
+    `timeout` seconds once `max_size` connections are in use, and every
+    idle connection is health-checked before it is handed out.
+    """
+    def __init__(self, db_path='users.db', max_size=5, timeout=5.0,
+                 pragmas=DEFAULT_PRAGMAS, uri=False):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = tuple(pragmas)
+        self.uri = uri
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'hits': 0,
+            'waits': 0,
+            'creations': 0,
+            'timeouts': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, uri=self.uri,
+                               check_same_thread=False)
+        try:
+            for name, value in self.pragmas:
+                conn.execute(f"PRAGMA {name} = {value}")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        """Check a connection out of the pool, creating one if the pool is
+        below `max_size`. Raise PoolTimeout if none frees up in time.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        conn = None
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise RuntimeError('connection pool is closed')
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot now; the connect happens unlocked
+                    self._size += 1
+                    break
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"no connection to {self.db_path!r} available "
+                        f"after {timeout}s")
+                self._cond.wait(remaining)
+            self._stats['checkouts'] += 1
+
+        if conn is not None:
+            if self._is_healthy(conn):
+                with self._cond:
+                    self._stats['hits'] += 1
+                return conn
+            # Broken connection: drop it and open a replacement in its slot
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._stats['discarded'] += 1
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['creations'] += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool. Any transaction left open is
+        rolled back so the next borrower starts from a clean state.
+        """
+        reusable = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            reusable = False
+
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append(conn)
+                conn = None
+            else:
+                self._size -= 1
+                if not reusable:
+                    self._stats['discarded'] += 1
+            self._cond.notify()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out for the duration
+        of the block.
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection and refuse further checkouts.
+        Connections still checked out are closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """Return a snapshot of the pool counters and current occupancy."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+            snapshot['in_use'] = self._size - len(self._idle)
+        return snapshot
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path='users.db', **kwargs):
+    """Return the process-wide pool for `db_path`, creating it on first use.
+    Keyword arguments are only applied when the pool is created.
+    """
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_path, **kwargs)
+            _pools[db_path] = pool
+        return pool
+
+
+def set_pool(db_path, pool):
+    """Make get_pool(db_path) return `pool`, closing the one it replaces.
+    Useful to point the decorators at another database (tests, benchmarks).
+    """
+    with _pools_lock:
+        previous = _pools.get(db_path)
+        _pools[db_path] = pool
+    if previous is not None and previous is not pool:
+        previous.close()
+
+
+def close_all_pools():
+    """Close and forget every pool created through get_pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import sqlite3
+import threading
+import time
+
+
+# SQLite VM instructions between deadline checks: frequent enough to stop
+# within a millisecond or so, rare enough to cost nothing measurable.
+CHECK_EVERY = 1000
+
+
+class QueryTimeout(sqlite3.OperationalError):
+    """Raised when a statement is interrupted because its deadline passed.
+    A subclass of OperationalError, so existing handlers still catch it.
+    """
+
+
+# Deadline currently armed on each connection, so a nested deadline can
+# tighten an outer one and restore it on exit
+_armed = {}
+_armed_lock = threading.Lock()
+
+
+class Deadline:
+    """Context manager that interrupts any statement `conn` runs once
+    `seconds` have passed, and turns the resulting 'interrupted' error
+    into QueryTimeout.
+
+    The check is a progress handler called by SQLite every `check_every`
+    VM instructions on the thread running the statement, so no timer
+    thread is needed. Nested deadlines on one connection keep the earliest
+    expiry. seconds=None arms nothing.
+    """
+    def __init__(self, conn, seconds, check_every=CHECK_EVERY):
+        self.conn = conn
+        self.seconds = seconds
+        self.check_every = check_every
+        self.expires = None
+        self._outer = None
+
+    def __enter__(self):
+        if self.seconds is None:
+            return self
+        expires = time.monotonic() + self.seconds
+        with _armed_lock:
+            self._outer = _armed.get(id(self.conn))
+            if self._outer is not None:
+                expires = min(expires, self._outer)
+            _armed[id(self.conn)] = expires
+        self.expires = expires
+        self.conn.set_progress_handler(
+            lambda: time.monotonic() >= expires, self.check_every)
+        return self
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def translate(self, exc):
+        """Return QueryTimeout for an 'interrupted' error raised after the
+        deadline, or `exc` unchanged.
+        """
+        if isinstance(exc, sqlite3.OperationalError) and \
+                not isinstance(exc, QueryTimeout) and \
+                'interrupted' in str(exc) and self.expired():
+            timeout = QueryTimeout(f"query exceeded its {self.seconds}s deadline")
+            timeout.__cause__ = exc
+            return timeout
+        return exc
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.expires is None:
+            return False
+        error = self.translate(exc_val) if exc_val is not None else None
+        outer = self._outer
+        with _armed_lock:
+            if outer is None:
+                _armed.pop(id(self.conn), None)
+            else:
+                _armed[id(self.conn)] = outer
+        try:
+            if outer is None:
+                self.conn.set_progress_handler(None, self.check_every)
+            else:
+                self.conn.set_progress_handler(
+                    lambda: time.monotonic() >= outer, self.check_every)
+        except sqlite3.ProgrammingError:
+            # Connection already closed
+            pass
+        self.expires = None
+        if error is not exc_val:
+            raise error
+        return False
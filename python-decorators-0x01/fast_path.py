@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import functools
+import inspect
+import time
+
+from db_pool import get_pool
+from query_log import caller_site
+from result_cache import (QueryCache, make_key, query_position, statement_kind,
+                          tables_read, tables_written)
+from retry_policy import RetryStats, decorrelated_jitter, default_budget, is_transient
+from transactions import scope
+
+
+# Cache shared by every fused(cache=True) function, so a write through one
+# of them invalidates reads cached by the others.
+default_cache = QueryCache(max_entries=256)
+_MISS = object()
+
+
+def fused(func=None, *, db_path='users.db', log=None, cache=None, retries=1,
+          delay=0.05, max_delay=2.0, retry_on=is_transient,
+          budget=default_budget, transaction=False):
+    """Build the usual decorator stack as one wrapper around `func`, which
+    takes a sqlite3 connection as its first argument (like functions
+    decorated with with_db_connection).
+
+    Per call this does what log_queries, cache_query, with_db_connection,
+    retry_on_failure and transactional would do when stacked, in that
+    order. It costs one Python frame instead of five. The position of the
+    'query' argument is resolved once here from func's signature, not
+    by scanning arguments for a SQL verb on each call. A cache hit also
+    returns before a pooled connection is checked out.
+
+    log         QueryLog that records every call with a query.
+    cache       QueryCache to use, or True for the shared default_cache.
+    retries     total attempts; 1 disables retrying.
+    transaction commit on success and roll back on error, as transactional.
+    """
+    if func is None:
+        return functools.partial(
+            fused, db_path=db_path, log=log, cache=cache, retries=retries,
+            delay=delay, max_delay=max_delay, retry_on=retry_on,
+            budget=budget, transaction=transaction)
+    if inspect.isgeneratorfunction(func) or inspect.iscoroutinefunction(func):
+        raise TypeError('fused only supports plain functions')
+    if cache is True:
+        cache = default_cache
+
+    position = query_position(func)
+    # Callers don't pass the connection, so their positions are shifted
+    arg_index = position - 1 if position else None
+    stats = RetryStats() if retries > 1 else None
+
+    def attempt(conn, args, kwargs):
+        if not transaction:
+            return func(conn, *args, **kwargs)
+        try:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            with scope(conn):
+                result = func(conn, *args, **kwargs)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def run(args, kwargs):
+        with get_pool(db_path).connection() as conn:
+            if stats is None:
+                return attempt(conn, args, kwargs)
+            stats.add(calls=1)
+            sleep = delay
+            for n in range(1, retries + 1):
+                stats.add(attempts=1)
+                try:
+                    result = attempt(conn, args, kwargs)
+                except Exception as e:
+                    if not retry_on(e):
+                        stats.add(failures=1, not_retryable=1)
+                        raise
+                    if budget is not None:
+                        budget.record_failure()
+                    if n == retries or (budget is not None and not budget.can_retry()):
+                        stats.add(failures=1)
+                        raise
+                else:
+                    stats.add(successes=1)
+                    if budget is not None:
+                        budget.record_success()
+                    return result
+                sleep = decorrelated_jitter(delay, max_delay, sleep)
+                stats.add(retries=1, backoff_seconds=sleep)
+                time.sleep(sleep)
+
+    def cached(query, args, kwargs):
+        kind = statement_kind(query)
+        if kind == 'read':
+            key = make_key(query, args, kwargs)
+            if key is None:
+                return run(args, kwargs)
+            result = cache.get(key, _MISS)
+            if result is _MISS:
+                tables = tables_read(query)
+                generation = cache.generation(tables)
+                result = run(args, kwargs)
+                cache.set(key, result, tables, generation=generation)
+            return result
+        if kind == 'write':
+            try:
+                return run(args, kwargs)
+            finally:
+                cache.invalidate_tables(tables_written(query))
+        return run(args, kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        query = kwargs.get('query')
+        if query is None and arg_index is not None and arg_index < len(args):
+            query = args[arg_index]
+        if query is None or (cache is None and log is None):
+            return run(args, kwargs)
+        if log is None:
+            return cached(query, args, kwargs)
+
+        caller = caller_site()
+        params = kwargs.get('params')
+        if params is None and arg_index is not None and arg_index + 1 < len(args):
+            params = args[arg_index + 1]
+        start = time.perf_counter()
+        try:
+            result = cached(query, args, kwargs) if cache is not None else run(args, kwargs)
+        except Exception as e:
+            log.record(query, params, time.perf_counter() - start,
+                       caller=caller, error=e)
+            raise
+        rows = len(result) if isinstance(result, (list, tuple)) else None
+        log.record(query, params, time.perf_counter() - start, rows, caller)
+        return result
+
+    wrapper.stats = stats
+    return wrapper
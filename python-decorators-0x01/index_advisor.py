@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Suggest indexes for a recorded query workload.
+
+Every distinct statement is run through EXPLAIN QUERY PLAN. Full table
+scans and temp B-trees (sorts/grouping without an index) are flagged,
+and candidate indexes are built for them. The workload is then timed on
+a scratch copy of the database, with and without each candidate.
+
+    python3 index_advisor.py queries.jsonl --db users.db
+    python3 index_advisor.py queries.jsonl --db users.db --json report.json
+
+The workload is JSON lines as written by QueryLog's stream_sink; use
+QueryLog(capture_params=True) so records carry the SQL and parameters.
+Lines that are not JSON are read as plain SQL. Placeholders without
+recorded parameters get a value sampled from the column they compare.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from result_cache import statement_kind, tables_read, tables_written
+
+
+_PLACEHOLDER_RE = re.compile(r'\?')
+_COMPARE_RE = re.compile(
+    r'([\w$]+)\s*(=|==|!=|<>|<=|>=|<|>|\bis\b|\blike\b|\bglob\b|\bin\s*\(|'
+    r'\bbetween\b)\s*$', re.I)
+_BETWEEN_AND_RE = re.compile(r'([\w$]+)\s+between\s+\?\s+and\s*$', re.I)
+_EQUALITY_RE = re.compile(r'([\w$]+)\s*(?:=|==|\bis\b|\bin\s*\()', re.I)
+_RANGE_RE = re.compile(r'([\w$]+)\s*(?:<=|>=|<|>|\bbetween\b|\blike\b|\bglob\b)', re.I)
+_WHERE_RE = re.compile(r'\bwhere\b(.*?)(?:\bgroup\s+by\b|\border\s+by\b|\blimit\b|$)',
+                       re.I | re.S)
+_ORDER_RE = re.compile(r'\b(?:order|group)\s+by\s+(.*?)(?:\blimit\b|\bhaving\b|$)',
+                       re.I | re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def load_workload(path):
+    """Return a Counter of (sql, params) -> number of occurrences."""
+    workload = Counter()
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                workload[(line.rstrip(';'), None)] += 1
+                continue
+            sql = record.get('sql') or record.get('query')
+            if not sql or record.get('error'):
+                continue
+            params = record.get('params')
+            if isinstance(params, list):
+                params = tuple(params)
+            elif isinstance(params, dict):
+                params = tuple(sorted(params.items()))
+            workload[(sql, params)] += 1
+    return workload
+
+
+def _bind(params):
+    if params and isinstance(params[0], tuple) and len(params[0]) == 2 \
+            and isinstance(params[0][0], str):
+        return dict(params)
+    return params or ()
+
+
+def columns_of(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def sample_params(conn, sql):
+    """Fill each '?' of `sql` with a value from the column it is compared
+    to (a row from the middle of the table), or NULL if there isn't one.
+    """
+    tables = sorted(tables_read(sql) | tables_written(sql))
+    known = {c.lower(): (t, c) for t in tables for c in columns_of(conn, t)}
+    values = []
+    for match in _PLACEHOLDER_RE.finditer(sql):
+        before = sql[:match.start()]
+        hit = _BETWEEN_AND_RE.search(before) or _COMPARE_RE.search(before)
+        column = known.get(hit.group(1).lower()) if hit else None
+        if column is None:
+            values.append(None)
+            continue
+        table, name = column
+        row = conn.execute(
+            f'SELECT "{name}" FROM "{table}" WHERE "{name}" IS NOT NULL LIMIT 1 '
+            f'OFFSET (SELECT count(*) FROM "{table}") / 2').fetchone()
+        values.append(row[0] if row else None)
+    return tuple(values)
+
+
+def query_plan(conn, sql, params):
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, _bind(params))]
+
+
+def problems(plan):
+    """Plan lines that show a full table scan or a temp B-tree."""
+    return [line for line in plan
+            if (line.startswith('SCAN ') and 'INDEX' not in line)
+            or 'TEMP B-TREE' in line]
+
+
+def _columns_in(pattern, text, columns):
+    found = []
+    for match in pattern.finditer(text):
+        name = columns.get(match.group(1).lower())
+        if name and name not in found:
+            found.append(name)
+    return found
+
+
+def candidates(conn, sql):
+    """Return [(table, column tuple)] indexes that could serve `sql`:
+    equality columns first, then one range column, then the ORDER BY /
+    GROUP BY columns when a sort is needed.
+    """
+    text = _STRING_RE.sub("''", sql)
+    where = _WHERE_RE.search(text)
+    where = where.group(1) if where else ''
+    order = _ORDER_RE.search(text)
+    order = order.group(1) if order else ''
+    result = []
+    for table in sorted(tables_read(sql) | tables_written(sql)):
+        columns = {c.lower(): c for c in columns_of(conn, table)}
+        columns.pop('rowid', None)
+        equality = _columns_in(_EQUALITY_RE, where, columns)
+        ranges = [c for c in _columns_in(_RANGE_RE, where, columns)
+                  if c not in equality]
+        sort = [columns[w.lower()] for w in re.findall(r'[\w$]+', order)
+                if w.lower() in columns]
+        if equality or ranges:
+            result.append((table, tuple(equality + ranges[:1])))
+        if sort:
+            result.append((table, tuple(c for c in equality + sort
+                                        if c not in ranges[:1])))
+    # Skip the integer primary key: the table itself is already ordered by it
+    return [(t, cols) for t, cols in dict.fromkeys(result)
+            if cols and not _is_rowid(conn, t, cols)]
+
+
+def _is_rowid(conn, table, cols):
+    info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    pk = [row for row in info if row[5]]
+    return len(pk) == 1 and pk[0][2].upper() == 'INTEGER' and cols[0] == pk[0][1]
+
+
+def existing_prefixes(conn, table):
+    """Column tuples of the indexes `table` already has."""
+    indexes = []
+    for row in conn.execute(f'PRAGMA index_list("{table}")'):
+        indexes.append(tuple(r[2] for r in conn.execute(f'PRAGMA index_info("{row[1]}")')))
+    return indexes
+
+
+def index_sql(table, cols):
+    name = f"idx_{table}_{'_'.join(cols)}".lower()
+    columns = ', '.join(f'"{c}"' for c in cols)
+    return name, f'CREATE INDEX "{name}" ON "{table}" ({columns})'
+
+
+def time_workload(conn, statements, repeat, errors=None):
+    """Return {sql: seconds} for the workload: the best of `repeat` runs
+    of each statement, weighted by its call count and summed per SQL text.
+    Writes run inside a transaction that is rolled back. A statement that
+    fails is left out of the timings and its error stored in `errors`
+    ({sql: message}) when given.
+    """
+    timings = Counter()
+    for (sql, params), count in statements:
+        best = float('inf')
+        write = statement_kind(sql) == 'write'
+        try:
+            for _ in range(repeat):
+                if write:
+                    conn.execute('BEGIN')
+                try:
+                    start = time.perf_counter()
+                    conn.execute(sql, _bind(params)).fetchall()
+                    best = min(best, time.perf_counter() - start)
+                finally:
+                    if conn.in_transaction:
+                        conn.rollback()
+        except sqlite3.Error as e:
+            if errors is not None:
+                errors.setdefault(sql, str(e))
+            continue
+        timings[sql] += best * count
+    return timings
+
+
+def advise(db_path, workload, repeat=3, max_params=5):
+    """Analyse `workload` (Counter of (sql, params)) against `db_path` and
+    return a report dict with the flagged statements and the candidates
+    ordered by estimated workload speedup.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = os.path.join(tmp, 'scratch.db')
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(scratch)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+        try:
+            return _advise(target, workload, repeat, max_params)
+        finally:
+            target.close()
+
+
+def _advise(conn, workload, repeat, max_params):
+    statements = []
+    per_sql = Counter()
+    for (sql, params), count in workload.most_common():
+        if per_sql[sql] >= max_params:
+            continue
+        per_sql[sql] += 1
+        if params is None and '?' in sql:
+            params = sample_params(conn, sql)
+        statements.append(((sql, params), count))
+
+    flagged = {}
+    proposals = {}
+    runnable = []
+    for (sql, params), count in statements:
+        try:
+            plan = query_plan(conn, sql, params)
+        except sqlite3.Error as e:
+            flagged[sql] = {'sql': sql, 'error': str(e)}
+            continue
+        runnable.append(((sql, params), count))
+        issues = problems(plan)
+        if not issues:
+            continue
+        if sql in flagged:
+            flagged[sql]['calls'] += count
+            continue
+        flagged[sql] = {'sql': sql, 'calls': count, 'plan': plan, 'issues': issues}
+        for table, cols in candidates(conn, sql):
+            if any(existing[:len(cols)] == cols for existing in existing_prefixes(conn, table)):
+                continue
+            proposals.setdefault((table, cols), set()).add(sql)
+
+    # Collect statistics once up front, so the baseline and every
+    # candidate are planned with them and only the index differs
+    conn.execute('ANALYZE')
+    errors = {}
+    before = time_workload(conn, runnable, repeat, errors)
+    for sql, message in errors.items():
+        flagged[sql] = {'sql': sql, 'error': message}
+    runnable = [item for item in runnable if item[0][0] not in errors]
+    total = sum(before.values())
+    results = []
+    for (table, cols), queries in proposals.items():
+        name, create = index_sql(table, cols)
+        conn.execute(create)
+        # Statistics for the new index only
+        conn.execute(f'ANALYZE "{name}"')
+        try:
+            after = time_workload(conn, runnable, repeat)
+            used = {sql for (sql, params), _ in runnable if sql in queries
+                    and any(name in line for line in query_plan(conn, sql, params))}
+        finally:
+            # Dropping the index also removes its sqlite_stat1 rows
+            conn.execute(f'DROP INDEX "{name}"')
+        targeted = sum(before[sql] for sql in queries)
+        targeted_after = sum(after[sql] for sql in queries)
+        with_index = sum(after.values())
+        results.append({
+            'index': create,
+            'queries': sorted(queries),
+            'used_by': sorted(used),
+            'queries_speedup': targeted / targeted_after if targeted_after else None,
+            'workload_before_ms': total * 1e3,
+            'workload_after_ms': with_index * 1e3,
+            'speedup': total / with_index if with_index else None,
+        })
+    results.sort(key=lambda r: r['speedup'] or 0, reverse=True)
+    return {'statements': len(runnable), 'workload_ms': total * 1e3,
+            'flagged': list(flagged.values()), 'candidates': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('workload', help='JSON-lines query log or SQL file')
+    parser.add_argument('--db', default='users.db')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timing runs per statement (best is kept)')
+    parser.add_argument('--max-params', type=int, default=5,
+                        help='distinct parameter sets replayed per statement')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args(argv)
+
+    report = advise(args.db, load_workload(args.workload), args.repeat,
+                    args.max_params)
+    print(f"{report['statements']} statements, "
+          f"{report['workload_ms']:.2f} ms per workload replay")
+    for item in report['flagged']:
+        if 'error' in item:
+            print(f"\n! {item['sql']}\n    failed: {item['error']}")
+            continue
+        print(f"\n! {item['sql']}  ({item['calls']} calls)")
+        for line in item['issues']:
+            print(f'    {line}')
+    if report['candidates']:
+        print(f"\n{'workload':>9}{'queries':>9}{'used':>6}  index")
+    for item in report['candidates']:
+        speedups = [f'{x:.2f}x' if x else '-'
+                    for x in (item['speedup'], item['queries_speedup'])]
+        print(f"{speedups[0]:>9}{speedups[1]:>9}{len(item['used_by']):>6}"
+              f"  {item['index']};")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
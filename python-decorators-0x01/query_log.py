@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+import atexit
+import functools
+import hashlib
+import json
+import math
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from result_cache import freeze, normalize_sql
+
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_STOP = object()
+# Modules whose wrappers can sit between a caller and the logged function
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_WRAPPER_MODULES = frozenset((
+    '0-log_queries.py', '1-with_db_connection.py', '2-transactional.py',
+    '3-retry_on_failure.py', '4-cache_query.py', 'fast_path.py',
+    'singleflight.py', 'streaming.py', 'transactions.py',
+))
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    """Return (id, text) identifying the shape of `query`: literals and
+    numbers become '?' and IN lists collapse, so calls that differ only
+    in their values share a fingerprint.
+    """
+    text = normalize_sql(query)
+    text = _STRING_RE.sub('?', text)
+    text = _NUMBER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('(?)', text)
+    digest = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+    return digest, text
+
+
+@functools.lru_cache(maxsize=256)
+def _is_wrapper_file(filename):
+    path = os.path.abspath(filename)
+    return os.path.dirname(path) == _PACKAGE_DIR and \
+        os.path.basename(path) in _WRAPPER_MODULES
+
+
+def caller_site(depth=1):
+    """Return 'file:line' of the code that called the function `depth`
+    frames up, skipping the frames of this package's decorator wrappers
+    so stacked decorators still report the user's call site.
+    """
+    frame = sys._getframe(depth + 1)
+    while frame.f_back is not None and frame.f_code.co_name != '<module>' \
+            and _is_wrapper_file(frame.f_code.co_filename):
+        frame = frame.f_back
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+
+def params_hash(params):
+    """Short stable hash of the bound parameters, or None if there are none."""
+    if params is None:
+        return None
+    try:
+        data = repr(freeze(params))
+    except TypeError:
+        data = repr(params)
+    return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+
+class LatencyHistogram:
+    """Log-scaled latency histogram. Buckets grow by `factor` from 1µs, so
+    percentiles are accurate to within that ratio using a few hundred ints.
+    """
+    def __init__(self, factor=1.1):
+        self.factor = factor
+        self._log_factor = math.log(factor)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = seconds * 1e6
+        index = int(math.log(micros) / self._log_factor) if micros > 1 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        """Return the latency in seconds below which `pct` percent of the
+        recorded calls fall (the bucket's upper bound).
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * pct / 100.0))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.factor ** (index + 1) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+def stream_sink(stream=None):
+    """Sink that writes each record as one JSON line to `stream`."""
+    def sink(record):
+        out = stream or sys.stdout
+        out.write(json.dumps(record, default=str) + '\n')
+        out.flush()
+    return sink
+
+
+class QueryLog:
+    """Collects per-query timings and ships structured records to a sink
+    on a background thread, so the decorated call never waits on I/O.
+
+    Every call updates the in-memory latency histogram of its fingerprint.
+    Only a `sample_rate` fraction of calls are queued for the sink, but
+    calls slower than `slow_threshold` seconds always are, and the writer
+    attaches their EXPLAIN QUERY PLAN (run on its own connection to
+    `db_path`, once per fingerprint). When the queue is full records are
+    dropped and counted rather than blocking the caller.
+
+    With capture_params=True records also carry the original SQL and its
+    bound parameters, so the log can be replayed (see index_advisor.py).
+    Only enable it where the parameters are safe to write out.
+    """
+    def __init__(self, sink=None, sample_rate=1.0, slow_threshold=0.1,
+                 db_path=None, max_queue=10000, capture_params=False):
+        self.sink = sink or stream_sink()
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.db_path = db_path
+        self.capture_params = capture_params
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._histograms = {}
+        self._queries = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._explain_conn = None
+        self.dropped = 0
+
+    def _ensure_writer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='query-log-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def record(self, query, params=None, duration=0.0, rows=None, caller=None,
+               error=None):
+        """Account one executed query. Cheap enough for the call path."""
+        fp_id, fp_text = fingerprint(query)
+        with self._lock:
+            hist = self._histograms.get(fp_id)
+            if hist is None:
+                hist = self._histograms[fp_id] = LatencyHistogram()
+                self._queries[fp_id] = fp_text
+            hist.record(duration)
+
+        slow = self.slow_threshold is not None and duration >= self.slow_threshold
+        if not slow and (self.sample_rate <= 0 or
+                         (self.sample_rate < 1 and random.random() >= self.sample_rate)):
+            return
+        record = {
+            'ts': time.time(),
+            'fingerprint': fp_id,
+            'query': fp_text,
+            'params_hash': params_hash(params),
+            'duration_ms': round(duration * 1000, 3),
+            'rows': rows,
+            'caller': caller,
+            'slow': slow,
+        }
+        if error is not None:
+            record['error'] = repr(error)
+        if self.capture_params:
+            record['sql'] = query
+            record['params'] = params if isinstance(params, dict) else \
+                list(params) if params is not None else None
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((record, query, params) if slow else (record, None, None))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _explain(self, fp_id, query, params):
+        if fp_id in self._plans:
+            return self._plans[fp_id]
+        plan = None
+        if self.db_path is not None:
+            try:
+                if self._explain_conn is None:
+                    self._explain_conn = sqlite3.connect(self.db_path)
+                cur = self._explain_conn.execute(
+                    'EXPLAIN QUERY PLAN ' + query,
+                    params if isinstance(params, (tuple, list, dict)) else ())
+                plan = [row[-1] for row in cur.fetchall()]
+            except sqlite3.Error as e:
+                plan = [f'unavailable: {e}']
+        with self._lock:
+            self._plans[fp_id] = plan
+        return plan
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    if self._explain_conn is not None:
+                        self._explain_conn.close()
+                        self._explain_conn = None
+                    return
+                record, query, params = item
+                if query is not None:
+                    record['plan'] = self._explain(record['fingerprint'], query, params)
+                self.sink(record)
+            except Exception:
+                # A broken sink must never take the writer down
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Drain the queue and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.close)
+
+    def stats(self):
+        """Return {fingerprint: latency snapshot + query text + plan}."""
+        with self._lock:
+            result = {}
+            for fp_id, hist in self._histograms.items():
+                snap = hist.snapshot()
+                snap['query'] = self._queries[fp_id]
+                snap['plan'] = self._plans.get(fp_id)
+                result[fp_id] = snap
+        return result
+
+    def top(self, n=10, by='total'):
+        """Return the `n` hottest fingerprints, ordered by `by`."""
+        return sorted(self.stats().items(), key=lambda item: item[1][by],
+                      reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._queries.clear()
+            self._plans.clear()
+            self.dropped = 0
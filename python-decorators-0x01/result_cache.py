@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+import functools
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+READ_VERBS = ('select', 'with')
+WRITE_VERBS = ('insert', 'update', 'delete', 'replace')
+
+# Quoted literals are kept verbatim; everything else is case-folded and has
+# its whitespace collapsed so trivially different spellings share a key.
+_LITERAL_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SPACE_RE = re.compile(r'\s+')
+_IDENT = r'[\w$]+|"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]'
+_READ_TABLE_RE = re.compile(
+    r'\b(?:from|join)\s+((?:(?:' + _IDENT + r')\.)?(?:' + _IDENT + r')'
+    r'(?:\s*(?:as\s+)?[\w$]+)?(?:\s*,\s*(?:(?:' + _IDENT + r')\.)?(?:'
+    + _IDENT + r')(?:\s*(?:as\s+)?[\w$]+)?)*)', re.I)
+_WRITE_TABLE_RE = re.compile(
+    r'^\s*(?:insert(?:\s+or\s+\w+)?\s+into|replace\s+into|update(?:\s+or\s+\w+)?'
+    r'|delete\s+from)\s+((?:(?:' + _IDENT + r')\.)?(?:' + _IDENT + r'))', re.I)
+_WORD_RE = re.compile(r'[\w$]+|[()]')
+_MISSING = object()
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """Return `query` with whitespace collapsed and keywords lowercased,
+    leaving quoted literals untouched and dropping a trailing ';'.
+    """
+    parts = _LITERAL_RE.split(query)
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACE_RE.sub(' ', parts[i]).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def _table_name(ident):
+    # Drop any schema prefix and identifier quoting: main."users" -> users
+    name = ident.strip().split()[0].split('.')[-1]
+    return name.strip('"`[]').lower()
+
+
+@functools.lru_cache(maxsize=1024)
+def tables_read(query):
+    """Return the (frozen) set of table names a SELECT reads from."""
+    tables = set()
+    for match in _READ_TABLE_RE.finditer(_STRING_RE.sub("''", query)):
+        for ident in match.group(1).split(','):
+            if ident.strip().startswith('('):
+                continue
+            tables.add(_table_name(ident))
+    return frozenset(tables)
+
+
+@functools.lru_cache(maxsize=1024)
+def main_statement(query):
+    """Return `query` from the verb of its main statement on, skipping the
+    common table expressions of a WITH query (WITH ... UPDATE is a write).
+    """
+    text = query.lstrip()
+    if text[:4].lower() != 'with':
+        return text
+    # Blank out quoted literals and names, keeping offsets, so parens and
+    # verbs inside them are ignored
+    masked = _LITERAL_RE.sub(lambda m: ' ' * len(m.group()), text)
+    depth = 0
+    for match in _WORD_RE.finditer(masked):
+        word = match.group()
+        if word == '(':
+            depth += 1
+        elif word == ')':
+            depth -= 1
+        elif depth == 0 and word.lower() in ('select', 'values') + WRITE_VERBS:
+            return text[match.start():]
+    return text
+
+
+@functools.lru_cache(maxsize=1024)
+def tables_written(query):
+    """Return the (frozen) set of table names an INSERT/UPDATE/DELETE
+    modifies, including one that follows WITH clauses.
+    """
+    match = _WRITE_TABLE_RE.match(main_statement(query))
+    return frozenset([_table_name(match.group(1))] if match else [])
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_kind(query):
+    """Classify `query` as 'read', 'write' or None from the verb of its
+    main statement (after any WITH clauses).
+    """
+    statement = main_statement(query)
+    verb = statement.split(None, 1)[0].lower() if statement.strip() else ''
+    if verb in READ_VERBS:
+        return 'read'
+    if verb in WRITE_VERBS:
+        return 'write'
+    return None
+
+
+def query_position(func):
+    """Return the index of func's positional parameter named 'query', or
+    None. Only func's own signature is inspected (not what it wraps), since
+    a wrapper such as with_db_connection changes the positions callers use.
+    """
+    try:
+        params = inspect.signature(func, follow_wrapped=False).parameters
+    except (TypeError, ValueError):
+        return None
+    for i, param in enumerate(params.values()):
+        if param.kind not in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            return None
+        if param.name == 'query':
+            return i
+    return None
+
+
+def freeze(value):
+    """Turn bound parameters into something hashable for use in a key.
+    Raise TypeError if that isn't possible.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    hash(value)
+    return value
+
+
+def is_connection(value):
+    """True for sqlite3 connections and connection-like objects (such as
+    aiosqlite's) that should never be part of a cache key.
+    """
+    if isinstance(value, sqlite3.Connection):
+        return True
+    return hasattr(value, 'execute') and hasattr(value, 'commit')
+
+
+def make_key(query, args=(), kwargs=None):
+    """Build a cache key from the normalized SQL plus every other argument
+    of the call. Connections are skipped since they don't affect results.
+    Return None if an argument can't be hashed.
+    """
+    try:
+        params = tuple(freeze(a) for a in args
+                       if a is not query and not is_connection(a))
+        named = tuple(sorted((k, freeze(v)) for k, v in (kwargs or {}).items()
+                             if k != 'query' and not is_connection(v)))
+    except TypeError:
+        return None
+    return (normalize_sql(query), params, named)
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results with an optional TTL.
+
+    Every entry remembers the tables its query reads, so a write to one of
+    those tables can evict exactly the entries it made stale. Each write
+    also bumps a per-table generation: take generation(tables) before
+    running a query and pass it to set(), and a result read before a
+    write that landed in the meantime is dropped instead of cached.
+    """
+    def __init__(self, max_entries=256, ttl=None):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+            'stale_discards': 0,
+        }
+
+    def _drop(self, key):
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, counting a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                self._drop(key)
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+            return default
+
+    def generation(self, tables):
+        """Return a token for the current generation of `tables`."""
+        with self._lock:
+            return tuple(self._generations.get(t, 0) for t in sorted(tables))
+
+    def set(self, key, value, tables=(), ttl=_MISSING, generation=None):
+        """Store `value` under `key`, tagged with the tables it depends on.
+
+        With `generation` (from generation(tables) before the query ran),
+        nothing is stored if one of the tables was written since; return
+        whether the value was stored.
+        """
+        if ttl is _MISSING:
+            ttl = self.ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        tables = frozenset(tables)
+        with self._lock:
+            if generation is not None and generation != tuple(
+                    self._generations.get(t, 0) for t in sorted(tables)):
+                self._stats['stale_discards'] += 1
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires_at, tables)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+        return True
+
+    def invalidate_tables(self, tables):
+        """Evict every entry that reads from any of `tables`. Return the
+        number of entries removed.
+        """
+        with self._lock:
+            keys = set()
+            for table in tables:
+                table = table.lower()
+                self._generations[table] = self._generations.get(table, 0) + 1
+                keys |= self._by_table.get(table, set())
+            for key in keys:
+                self._drop(key)
+            self._stats['invalidations'] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self):
+        """Return a snapshot of the hit/miss/eviction counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['entries'] = len(self._entries)
+        return snapshot
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
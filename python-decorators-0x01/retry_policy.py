@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import random
+import sqlite3
+import threading
+
+
+# Messages of sqlite3.OperationalError that describe a lock held by someone
+# else: waiting and trying again can succeed. Anything else (syntax errors,
+# missing tables, constraint violations...) will fail the same way again.
+TRANSIENT_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'database schema has changed',
+    'database is busy',
+)
+
+
+def is_transient(exc):
+    """Return True if `exc` is a SQLite error worth retrying."""
+    if isinstance(exc, sqlite3.OperationalError):
+        message = str(exc).lower()
+        return any(m in message for m in TRANSIENT_MESSAGES)
+    return False
+
+
+def decorrelated_jitter(base, cap, previous):
+    """Next sleep for "decorrelated jitter" backoff: a random value between
+    `base` and three times the previous sleep, capped at `cap`. Retrying
+    clients drift apart instead of waking up in lock-step.
+    """
+    return min(cap, random.uniform(base, max(base, previous * 3)))
+
+
+class RetryBudget:
+    """Process-wide token bucket that caps how much retrying can amplify
+    load (the scheme gRPC uses for retry throttling).
+
+    Each failed attempt takes one token and each success gives back
+    `token_ratio`. Retries are only allowed while more than half of
+    `max_tokens` remain, so when most calls fail retries stop until
+    successes refill the bucket.
+    """
+    def __init__(self, max_tokens=10, token_ratio=0.1):
+        self.max_tokens = float(max_tokens)
+        self.token_ratio = token_ratio
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.token_ratio)
+
+    def record_failure(self):
+        with self._lock:
+            self._tokens = max(0.0, self._tokens - 1)
+
+    def can_retry(self):
+        with self._lock:
+            return self._tokens > self.max_tokens / 2
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return self._tokens
+
+
+default_budget = RetryBudget()
+
+
+class RetryStats:
+    """Thread-safe counters for one retrying function."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'successes': 0,
+            'failures': 0,
+            'not_retryable': 0,
+            'budget_exhausted': 0,
+            'backoff_seconds': 0.0,
+        }
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self._counts[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
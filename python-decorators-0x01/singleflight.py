@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import asyncio
+import functools
+import inspect
+import threading
+
+from result_cache import freeze, is_connection
+
+
+class _Call:
+    """An in-flight call that followers can wait on."""
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into a single execution.
+
+    The first thread to ask for a key runs the function; every other thread
+    asking for the same key while it runs blocks and receives the same
+    result (or the same exception). Nothing is kept once the call returns.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self._stats['leaders'] += 1
+            else:
+                call.followers += 1
+                leader = False
+                self._stats['followers'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['in_flight'] = len(self._calls)
+        return snapshot
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutine functions.
+
+    The leader's coroutine runs as its own task and every caller awaits it
+    through asyncio.shield, so cancelling one waiter (even the one that
+    started it) doesn't cancel the query for the others.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._stats = {'leaders': 0, 'followers': 0}
+
+    async def do(self, key, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Tasks belong to one loop, so never share them across loops
+        flight_key = (id(loop), key)
+        task = self._calls.get(flight_key)
+        if task is None or task.get_loop() is not loop:
+            task = loop.create_task(fn(*args, **kwargs))
+            self._calls[flight_key] = task
+            self._stats['leaders'] += 1
+
+            def _forget(t, flight_key=flight_key):
+                if self._calls.get(flight_key) is t:
+                    del self._calls[flight_key]
+            task.add_done_callback(_forget)
+        else:
+            self._stats['followers'] += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        snapshot['in_flight'] = len(self._calls)
+        return snapshot
+
+
+def call_key(func, args, kwargs):
+    """Default coalescing key: the function plus its hashable arguments,
+    ignoring any connection objects. Return None when unhashable.
+    """
+    try:
+        return (func.__module__, func.__qualname__,
+                tuple(freeze(a) for a in args if not is_connection(a)),
+                tuple(sorted((k, freeze(v)) for k, v in kwargs.items()
+                             if not is_connection(v))))
+    except TypeError:
+        return None
+
+
+def single_flight(func=None, *, key=call_key):
+    """Decorator that coalesces concurrent identical calls to `func`.
+    Works for plain functions (threads wait on the leader) and for
+    coroutine functions (tasks await the leader's task). `key` receives
+    (func, args, kwargs) and returns the coalescing key, or None to run the
+    call on its own.
+    """
+    if func is None:
+        return functools.partial(single_flight, key=key)
+
+    if inspect.iscoroutinefunction(func):
+        flight = AsyncSingleFlight()
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            k = key(func, args, kwargs)
+            if k is None:
+                return await func(*args, **kwargs)
+            return await flight.do(k, func, *args, **kwargs)
+
+        async_wrapper.flight = flight
+        return async_wrapper
+
+    flight = SingleFlight()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        k = key(func, args, kwargs)
+        if k is None:
+            return func(*args, **kwargs)
+        return flight.do(k, func, *args, **kwargs)
+
+    wrapper.flight = flight
+    return wrapper
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_rows(cursor, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield the rows of an executed cursor one at a time, pulling them
+    `batch_size` at a time with fetchmany so only one batch is ever held
+    in memory. The cursor is closed once the rows run out or the consumer
+    stops early.
+    """
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def iter_batches(cursor, batch_size=DEFAULT_BATCH_SIZE):
+    """Like iter_rows but yield each fetchmany batch as a list."""
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
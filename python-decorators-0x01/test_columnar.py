@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import unittest
+from array import array
+
+from columnar import ColumnarResult, TextColumn
+
+
+class TestColumnarResult(unittest.TestCase):
+	def test_column_is_a_view(self):
+		result = ColumnarResult.from_rows(['id'], [(i,) for i in range(10)])
+		storage = result._columns[0]
+		view = result[2:5].column('id')
+		self.assertIsInstance(view, memoryview)
+		self.assertEqual(view.tolist(), [2, 3, 4])
+		self.assertIs(view.obj, storage)
+
+	def test_mixed_int_float_keeps_precision(self):
+		big = 2 ** 53 + 1
+		result = ColumnarResult.from_rows(['n'], [(big,), (1.5,), (None,)])
+		self.assertEqual(result.tolist(), [(big,), (1.5,), (None,)])
+		self.assertEqual(result.column('n'), [big, 1.5, None])
+		result = ColumnarResult.from_rows(['n'], [(1.5,), (big,)])
+		self.assertIs(result[1][0], big)
+
+	def test_text_nulls(self):
+		result = ColumnarResult.from_rows(['name'], [('a',), (None,), ('',)])
+		self.assertEqual(result.tolist(), [('a',), (None,), ('',)])
+		column = result.column('name')
+		self.assertIsInstance(column, TextColumn)
+		self.assertEqual(list(column), ['a', None, ''])
+		self.assertEqual(list(column[1:]), [None, ''])
+
+	def test_numeric_storage(self):
+		result = ColumnarResult.from_rows(['i', 'f'], [(1, 0.5), (None, 2.5)])
+		self.assertIsInstance(result._columns[0], array)
+		self.assertEqual(result.column('i').tolist(), [1, 0])
+		self.assertEqual(result.nulls('i'), bytearray([0, 1]))
+		self.assertEqual(result.column('f').tolist(), [0.5, 2.5])
+
+
+if __name__ == '__main__':
+	unittest.main()
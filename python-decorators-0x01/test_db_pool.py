@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.pool = ConnectionPool(os.path.join(self.tmp.name, 'users.db'),
+			max_size=2, timeout=0.1)
+
+	def tearDown(self):
+		self.pool.close()
+		self.tmp.cleanup()
+
+	def test_checkout_timeout(self):
+		first = self.pool.acquire()
+		second = self.pool.acquire()
+		start = time.monotonic()
+		with self.assertRaises(PoolTimeout):
+			self.pool.acquire()
+		self.assertGreaterEqual(time.monotonic() - start, 0.1)
+		stats = self.pool.stats()
+		self.assertEqual((stats['timeouts'], stats['in_use']), (1, 2))
+		self.pool.release(first)
+		self.pool.release(second)
+
+	def test_waiter_gets_released_connection(self):
+		held = [self.pool.acquire(), self.pool.acquire()]
+		timer = threading.Timer(0.02, self.pool.release, args=(held[0],))
+		timer.start()
+		conn = self.pool.acquire(timeout=1)
+		timer.join()
+		self.assertIs(conn, held[0])
+		self.assertEqual(self.pool.stats()['waits'], 1)
+		self.pool.release(conn)
+		self.pool.release(held[1])
+
+	def test_broken_idle_connection_is_replaced(self):
+		conn = self.pool.acquire()
+		self.pool.release(conn)
+		# Breaks it behind the pool's back: the health check must notice
+		conn.close()
+		replacement = self.pool.acquire()
+		self.assertIsNot(replacement, conn)
+		self.assertEqual(replacement.execute('SELECT 1').fetchone(), (1,))
+		stats = self.pool.stats()
+		self.assertEqual((stats['discarded'], stats['creations'], stats['size']),
+			(1, 2, 1))
+		self.pool.release(replacement)
+
+	def test_release_rolls_back_open_transaction(self):
+		with self.pool.connection() as conn:
+			conn.execute('CREATE TABLE t (x)')
+			conn.commit()
+			conn.execute('INSERT INTO t VALUES (1)')
+		with self.pool.connection() as again:
+			self.assertIs(again, conn)
+			self.assertFalse(again.in_transaction)
+			self.assertEqual(again.execute('SELECT count(*) FROM t').fetchone(), (0,))
+
+	def test_closed_pool_refuses_checkout(self):
+		self.pool.close()
+		with self.assertRaises(RuntimeError):
+			self.pool.acquire()
+
+
+if __name__ == '__main__':
+	unittest.main()
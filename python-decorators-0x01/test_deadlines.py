@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import sqlite3
+import time
+import unittest
+
+from deadlines import Deadline, QueryTimeout
+
+# Counts to a billion: far longer than any deadline below
+SLOW_QUERY = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n '
+	'WHERE i < 1000000000) SELECT count(*) FROM n')
+
+
+class TestDeadline(unittest.TestCase):
+	def setUp(self):
+		self.conn = sqlite3.connect(':memory:')
+
+	def tearDown(self):
+		self.conn.close()
+
+	def test_interrupts_long_query(self):
+		start = time.monotonic()
+		with self.assertRaises(QueryTimeout) as raised:
+			with Deadline(self.conn, 0.05):
+				self.conn.execute(SLOW_QUERY).fetchone()
+		self.assertLess(time.monotonic() - start, 1.0)
+		self.assertIsInstance(raised.exception, sqlite3.OperationalError)
+		# The connection is still usable and no longer armed
+		self.assertEqual(self.conn.execute('SELECT 1').fetchone(), (1,))
+
+	def test_fast_query_is_untouched(self):
+		with Deadline(self.conn, 5):
+			self.assertEqual(self.conn.execute('SELECT 2').fetchone(), (2,))
+
+	def test_nested_deadline_keeps_earliest(self):
+		start = time.monotonic()
+		with Deadline(self.conn, 0.05):
+			with self.assertRaises(QueryTimeout):
+				# The inner deadline can't extend the outer one
+				with Deadline(self.conn, 10):
+					self.conn.execute(SLOW_QUERY).fetchone()
+		self.assertLess(time.monotonic() - start, 1.0)
+
+	def test_none_arms_nothing(self):
+		deadline = Deadline(self.conn, None)
+		with deadline:
+			self.conn.execute('SELECT 1')
+		self.assertIsNone(deadline.expires)
+
+	def test_other_errors_pass_through(self):
+		with self.assertRaises(sqlite3.OperationalError) as raised:
+			with Deadline(self.conn, 5):
+				self.conn.execute('SELECT * FROM missing')
+		self.assertNotIsInstance(raised.exception, QueryTimeout)
+
+
+if __name__ == '__main__':
+	unittest.main()
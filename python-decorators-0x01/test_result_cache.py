@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db_pool import ConnectionPool, close_all_pools, set_pool
+from result_cache import QueryCache, main_statement, statement_kind, tables_written
+
+_spec = importlib.util.spec_from_file_location(
+	'cache_module',
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '4-cache_query.py'))
+cache_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(cache_module)
+
+CTE_UPDATE = ('WITH old AS (SELECT id FROM users WHERE age < 30) '
+	'UPDATE users SET age = age + 1 WHERE id IN (SELECT id FROM old)')
+
+
+class TestStatementKind(unittest.TestCase):
+	def test_classification(self):
+		cases = [
+			('SELECT * FROM users', 'read', set()),
+			('  insert into users (name) values (?)', 'write', {'users'}),
+			(CTE_UPDATE, 'write', {'users'}),
+			("WITH a(x) AS (VALUES ('delete')) INSERT INTO logs SELECT x FROM a",
+				'write', {'logs'}),
+			('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n '
+				'WHERE i < 5) SELECT * FROM n', 'read', set()),
+			('WITH d AS (SELECT 1) DELETE FROM main."Users"', 'write', {'users'}),
+			('PRAGMA user_version', None, set()),
+		]
+		for query, kind, written in cases:
+			with self.subTest(query=query):
+				self.assertEqual(statement_kind(query), kind)
+				self.assertEqual(tables_written(query), written)
+
+	def test_main_statement(self):
+		self.assertTrue(main_statement(CTE_UPDATE).startswith('UPDATE users'))
+		self.assertEqual(main_statement('SELECT 1'), 'SELECT 1')
+
+
+class TestQueryCache(unittest.TestCase):
+	def test_result_read_before_a_write_is_not_stored(self):
+		cache = QueryCache()
+		generation = cache.generation({'users'})
+		cache.invalidate_tables(['users'])
+		self.assertFalse(cache.set('k', [(18,)], {'users'}, generation=generation))
+		self.assertNotIn('k', cache)
+		self.assertEqual(cache.stats()['stale_discards'], 1)
+		self.assertTrue(cache.set('k', [(99,)], {'users'},
+			generation=cache.generation({'users'})))
+
+
+class TestCacheQuery(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		path = os.path.join(self.tmp.name, 'users.db')
+		conn = sqlite3.connect(path)
+		conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER)')
+		conn.executemany('INSERT INTO users (age) VALUES (?)', [(20,), (40,)])
+		conn.commit()
+		conn.close()
+		set_pool('users.db', ConnectionPool(path))
+		cache_module.query_cache.clear()
+
+	def tearDown(self):
+		close_all_pools()
+		self.tmp.cleanup()
+
+	def test_cte_write_invalidates_cached_reads(self):
+		@cache_module.with_db_connection
+		@cache_module.cache_query
+		def run(conn, query):
+			rows = conn.execute(query).fetchall()
+			conn.commit()
+			return rows
+
+		read = 'SELECT age FROM users ORDER BY id'
+		self.assertEqual(run(read), [(20,), (40,)])
+		self.assertEqual(run(CTE_UPDATE), [])
+		self.assertEqual(run(read), [(21,), (40,)])
+		self.assertEqual(run(CTE_UPDATE), [])
+		self.assertEqual(run(read), [(22,), (40,)])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import importlib.util
+import os
+import sqlite3
+import unittest
+
+from retry_policy import RetryBudget, is_transient
+
+_spec = importlib.util.spec_from_file_location(
+	'retry_module',
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '3-retry_on_failure.py'))
+retry_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(retry_module)
+retry_on_failure = retry_module.retry_on_failure
+
+
+def locked():
+	return sqlite3.OperationalError('database is locked')
+
+
+class TestRetryBudget(unittest.TestCase):
+	def test_failures_drain_and_successes_refill(self):
+		budget = RetryBudget(max_tokens=4, token_ratio=0.5)
+		budget.record_failure()
+		self.assertTrue(budget.can_retry())
+		budget.record_failure()
+		# Retries need more than half the tokens left
+		self.assertEqual(budget.tokens, 2)
+		self.assertFalse(budget.can_retry())
+		budget.record_success()
+		self.assertTrue(budget.can_retry())
+
+	def test_is_transient(self):
+		self.assertTrue(is_transient(locked()))
+		self.assertFalse(is_transient(sqlite3.OperationalError('no such table: x')))
+		self.assertFalse(is_transient(ValueError('database is locked')))
+
+
+class TestRetryOnFailure(unittest.TestCase):
+	def test_budget_cuts_retries_off(self):
+		budget = RetryBudget(max_tokens=4)
+		attempts = []
+
+		@retry_on_failure(retries=10, delay=0, max_delay=0, budget=budget)
+		def always_locked():
+			attempts.append(1)
+			raise locked()
+
+		with self.assertRaises(sqlite3.OperationalError):
+			always_locked()
+		# 4 -> 3 tokens allows one retry, 3 -> 2 doesn't: 2 of 10 attempts
+		self.assertEqual(len(attempts), 2)
+		with self.assertRaises(sqlite3.OperationalError):
+			always_locked()
+		# Exhausted budget: no retry at all now
+		self.assertEqual(len(attempts), 3)
+		stats = always_locked.stats.snapshot()
+		self.assertEqual(stats['budget_exhausted'], 2)
+		self.assertEqual(stats['retries'], 1)
+
+	def test_transient_error_is_retried(self):
+		results = iter([locked(), locked(), 'ok'])
+
+		@retry_on_failure(retries=3, delay=0, max_delay=0, budget=RetryBudget())
+		def flaky():
+			result = next(results)
+			if isinstance(result, Exception):
+				raise result
+			return result
+
+		self.assertEqual(flaky(), 'ok')
+		stats = flaky.stats.snapshot()
+		self.assertEqual((stats['attempts'], stats['retries'], stats['successes']),
+			(3, 2, 1))
+
+	def test_permanent_error_is_not_retried(self):
+		attempts = []
+
+		@retry_on_failure(retries=5, delay=0, max_delay=0, budget=RetryBudget())
+		def broken():
+			attempts.append(1)
+			raise sqlite3.OperationalError('no such table: users')
+
+		with self.assertRaises(sqlite3.OperationalError):
+			broken()
+		self.assertEqual(len(attempts), 1)
+		self.assertEqual(broken.stats.snapshot()['not_retryable'], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
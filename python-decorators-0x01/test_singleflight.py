@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import asyncio
+import threading
+import time
+import unittest
+
+from singleflight import single_flight
+
+CALLERS = 8
+
+
+def wait_for(condition, timeout=2.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			raise AssertionError('condition not reached')
+		time.sleep(0.001)
+
+
+class TestSingleFlight(unittest.TestCase):
+	def run_callers(self, func, *args):
+		results = [None] * CALLERS
+
+		def call(i):
+			try:
+				results[i] = func(*args)
+			except Exception as e:
+				results[i] = e
+
+		threads = [threading.Thread(target=call, args=(i,)) for i in range(CALLERS)]
+		for t in threads:
+			t.start()
+		return threads, results
+
+	def test_concurrent_calls_are_coalesced(self):
+		calls = []
+		release = threading.Event()
+
+		@single_flight
+		def lookup(user_id):
+			calls.append(user_id)
+			release.wait()
+			return {'id': user_id}
+
+		threads, results = self.run_callers(lookup, 7)
+		wait_for(lambda: lookup.flight.stats()['followers'] == CALLERS - 1)
+		release.set()
+		for t in threads:
+			t.join()
+		self.assertEqual(calls, [7])
+		self.assertEqual(results, [{'id': 7}] * CALLERS)
+		self.assertEqual(lookup.flight.stats(),
+			{'leaders': 1, 'followers': CALLERS - 1, 'in_flight': 0})
+
+	def test_error_is_shared_and_not_kept(self):
+		release = threading.Event()
+		attempts = []
+
+		@single_flight
+		def lookup(user_id):
+			attempts.append(user_id)
+			release.wait()
+			if len(attempts) == 1:
+				raise ValueError('boom')
+			return user_id
+
+		threads, results = self.run_callers(lookup, 1)
+		wait_for(lambda: lookup.flight.stats()['followers'] == CALLERS - 1)
+		release.set()
+		for t in threads:
+			t.join()
+		self.assertTrue(all(isinstance(r, ValueError) for r in results))
+		# The failure isn't cached: the next call runs again
+		self.assertEqual(lookup(1), 1)
+		self.assertEqual(len(attempts), 2)
+
+	def test_different_keys_run_separately(self):
+		calls = []
+
+		@single_flight
+		def lookup(user_id):
+			calls.append(user_id)
+			return user_id
+
+		self.assertEqual([lookup(1), lookup(2), lookup(1)], [1, 2, 1])
+		self.assertEqual(calls, [1, 2, 1])
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+	def test_tasks_are_coalesced(self):
+		calls = []
+
+		@single_flight
+		async def lookup(user_id):
+			calls.append(user_id)
+			await asyncio.sleep(0.01)
+			return user_id * 2
+
+		async def main():
+			return await asyncio.gather(*(lookup(21) for _ in range(CALLERS)))
+
+		self.assertEqual(asyncio.run(main()), [42] * CALLERS)
+		self.assertEqual(calls, [21])
+		self.assertEqual(lookup.flight.stats()['followers'], CALLERS - 1)
+
+	def test_cancelled_waiter_leaves_others_running(self):
+		@single_flight
+		async def lookup(user_id):
+			await asyncio.sleep(0.02)
+			return user_id
+
+		async def main():
+			first = asyncio.ensure_future(lookup(3))
+			second = asyncio.ensure_future(lookup(3))
+			await asyncio.sleep(0)
+			first.cancel()
+			return await second
+
+		self.assertEqual(asyncio.run(main()), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
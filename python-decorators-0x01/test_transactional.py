@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from db_pool import ConnectionPool, close_all_pools, set_pool
+from transactions import GroupCommitter, GroupCommitTimeout
+
+_spec = importlib.util.spec_from_file_location(
+	'transactional_module',
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '2-transactional.py'))
+transactional_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(transactional_module)
+with_db_connection = transactional_module.with_db_connection
+transactional = transactional_module.transactional
+
+CALLERS = 29
+POOL_SIZE = 5
+
+
+class DatabaseTestCase(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmp.name, 'users.db')
+		conn = sqlite3.connect(self.path)
+		conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)')
+		conn.commit()
+		conn.close()
+		self.pool = ConnectionPool(self.path, max_size=POOL_SIZE)
+		set_pool('users.db', self.pool)
+
+	def tearDown(self):
+		close_all_pools()
+		self.tmp.cleanup()
+
+	def emails(self):
+		conn = sqlite3.connect(self.path)
+		try:
+			return dict(conn.execute('SELECT id, email FROM users'))
+		finally:
+			conn.close()
+
+
+class TestNestedTransactional(DatabaseTestCase):
+	"""Decorated transactional calls made from inside another one."""
+	def setUp(self):
+		super().setUp()
+
+		@with_db_connection
+		@transactional
+		def add_user(conn, user_id, fail=False):
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(user_id, f'user{user_id}@example.com'))
+			if fail:
+				raise ValueError(user_id)
+			return user_id
+
+		self.add_user = add_user
+
+	def test_nested_call_joins_the_outer_transaction(self):
+		@with_db_connection
+		@transactional
+		def add_pair(conn, first, second):
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(first, 'outer@example.com'))
+			self.add_user(second)
+			# The inner write is visible here but not committed yet
+			self.assertEqual(self.emails(), {})
+			return conn.in_transaction
+
+		self.assertTrue(add_pair(1, 2))
+		self.assertEqual(self.emails(),
+			{1: 'outer@example.com', 2: 'user2@example.com'})
+		# The nested call reused the outer connection
+		self.assertEqual(self.pool.stats()['creations'], 1)
+
+	def test_failed_inner_call_only_rolls_back_its_savepoint(self):
+		@with_db_connection
+		@transactional
+		def add_some(conn):
+			self.add_user(1)
+			with self.assertRaises(ValueError):
+				self.add_user(2, fail=True)
+			self.add_user(3)
+
+		add_some()
+		self.assertEqual(sorted(self.emails()), [1, 3])
+
+	def test_failed_outer_call_rolls_back_inner_work(self):
+		@with_db_connection
+		@transactional
+		def add_then_fail(conn):
+			self.add_user(1)
+			raise RuntimeError('outer')
+
+		with self.assertRaises(RuntimeError):
+			add_then_fail()
+		self.assertEqual(self.emails(), {})
+		self.assertEqual(self.pool.stats()['in_use'], 0)
+
+	def test_nested_group_commit_call_becomes_a_savepoint(self):
+		committer = GroupCommitter(window=0)
+
+		@with_db_connection
+		@transactional(group_commit=committer)
+		def add_grouped(conn, user_id):
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(user_id, 'grouped@example.com'))
+
+		@with_db_connection
+		@transactional
+		def add_some(conn):
+			add_grouped(1)
+			raise RuntimeError('outer')
+
+		with self.assertRaises(RuntimeError):
+			add_some()
+		# Rolled back with the outer transaction, never seen by the committer
+		self.assertEqual(self.emails(), {})
+		self.assertEqual(committer.stats()['calls'], 0)
+
+
+class TestGroupCommit(DatabaseTestCase):
+	"""transactional(group_commit=...) under with_db_connection."""
+	def setUp(self):
+		super().setUp()
+		self.committer = GroupCommitter(window=0.2, max_batch=64)
+
+	def run_concurrently(self, func, calls):
+		barrier = threading.Barrier(len(calls))
+		results = [None] * len(calls)
+
+		def call(i, args):
+			barrier.wait()
+			try:
+				results[i] = func(*args)
+			except Exception as e:
+				results[i] = e
+
+		threads = [threading.Thread(target=call, args=(i, args))
+			for i, args in enumerate(calls)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		return results
+
+	def test_batches_are_not_capped_by_the_pool(self):
+		@with_db_connection
+		@transactional(group_commit=self.committer)
+		def add_user(conn, user_id):
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(user_id, f'user{user_id}@example.com'))
+			return user_id
+
+		results = self.run_concurrently(add_user, [(i,) for i in range(CALLERS)])
+		self.assertEqual(results, list(range(CALLERS)))
+		self.assertEqual(len(self.emails()), CALLERS)
+		stats = self.committer.stats()
+		self.assertEqual(stats['calls'], CALLERS)
+		self.assertLess(stats['batches'], -(-CALLERS // POOL_SIZE))
+		# Waiting callers hold no connection, so nobody queued on the pool
+		self.assertEqual(self.pool.stats()['waits'], 0)
+		self.assertEqual(self.pool.stats()['in_use'], 0)
+
+	def test_failed_call_only_rolls_back_its_own_write(self):
+		@with_db_connection
+		@transactional(group_commit=self.committer)
+		def add_user(conn, user_id, fail=False):
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(user_id, f'user{user_id}@example.com'))
+			if fail:
+				raise ValueError(user_id)
+			return user_id
+
+		calls = [(i, i % 4 == 0) for i in range(12)]
+		results = self.run_concurrently(add_user, calls)
+		for (user_id, fail), result in zip(calls, results):
+			if fail:
+				self.assertIsInstance(result, ValueError)
+			else:
+				self.assertEqual(result, user_id)
+		self.assertEqual(sorted(self.emails()),
+			[user_id for user_id, fail in calls if not fail])
+		self.assertEqual(self.committer.stats()['rolled_back'], 3)
+		self.assertLess(self.committer.stats()['batches'], len(calls))
+
+	def test_waiter_not_picked_up_times_out(self):
+		committer = GroupCommitter(window=0, wait_timeout=0.05)
+		started = threading.Event()
+		release = threading.Event()
+
+		@with_db_connection
+		@transactional(group_commit=committer)
+		def add_user(conn, user_id):
+			started.set()
+			release.wait()
+			conn.execute('INSERT INTO users (id, email) VALUES (?, ?)',
+				(user_id, f'user{user_id}@example.com'))
+
+		leader = threading.Thread(target=add_user, args=(1,))
+		leader.start()
+		started.wait()
+		# The leader's batch is stuck, so this call is never picked up
+		with self.assertRaises(GroupCommitTimeout):
+			add_user(2)
+		release.set()
+		leader.join()
+		self.assertEqual(self.emails(), {1: 'user1@example.com'})
+		stats = committer.stats()
+		self.assertEqual((stats['timeouts'], stats['pending'], stats['batches']),
+			(1, 0, 1))
+
+	def test_explicit_connection(self):
+		conn = sqlite3.connect(self.path, check_same_thread=False)
+		try:
+			@transactional(group_commit=self.committer)
+			def set_email(conn, user_id, email):
+				conn.execute('INSERT OR REPLACE INTO users (id, email) VALUES (?, ?)',
+					(user_id, email))
+				return email
+
+			self.assertEqual(set_email(conn, 1, 'a@example.com'), 'a@example.com')
+			self.assertEqual(self.emails(), {1: 'a@example.com'})
+		finally:
+			conn.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# Nesting depth of `transactional` per connection. A connection is only
+# used by one thread at a time (see db_pool), so a thread-local map keyed by
+# id() is enough; entries are removed when the depth drops back to 0. The
+# thread's open scopes are also kept in order, innermost last, so a nested
+# call that doesn't get the connection passed in can still join it.
+_local = threading.local()
+
+
+class GroupCommitTimeout(Exception):
+    """Raised when a call queued for group commit isn't picked up by a
+    batch before the wait timeout expires. Nothing of the call has run.
+    """
+
+
+def _depths():
+    depths = getattr(_local, 'depths', None)
+    if depths is None:
+        depths = _local.depths = {}
+    return depths
+
+
+def _open_scopes():
+    scopes = getattr(_local, 'scopes', None)
+    if scopes is None:
+        scopes = _local.scopes = []
+    return scopes
+
+
+def depth(conn):
+    """How many transactional scopes are currently open on `conn`."""
+    return _depths().get(id(conn), 0)
+
+
+def active_connection():
+    """The connection of the innermost transactional scope open in this
+    thread, or None outside of any.
+    """
+    scopes = _open_scopes()
+    return scopes[-1] if scopes else None
+
+
+@contextmanager
+def scope(conn):
+    """Mark one more transactional scope open on `conn` for the block."""
+    depths = _depths()
+    scopes = _open_scopes()
+    key = id(conn)
+    depths[key] = depths.get(key, 0) + 1
+    scopes.append(conn)
+    try:
+        yield depths[key]
+    finally:
+        scopes.pop()
+        depths[key] -= 1
+        if not depths[key]:
+            del depths[key]
+
+
+@contextmanager
+def savepoint(conn, name='sp'):
+    """Run the block inside SAVEPOINT `name`: released on success, rolled
+    back to (and released) on error, which is then re-raised.
+    """
+    conn.execute(f'SAVEPOINT {name}')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f'ROLLBACK TO {name}')
+        conn.execute(f'RELEASE {name}')
+        raise
+    conn.execute(f'RELEASE {name}')
+
+
+class _Request:
+    __slots__ = ('func', 'args', 'kwargs', 'result', 'error', 'promoted',
+                 'done')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.promoted = False
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """Batches concurrent write transactions into a single commit.
+
+    The first caller to arrive becomes the leader: it waits up to `window`
+    seconds (or until `max_batch` calls are queued), then runs every queued
+    call on its own connection inside one transaction, each call in its own
+    SAVEPOINT, and commits once. A call that raises only rolls back its own
+    savepoint; every caller gets back its own result or exception. When
+    the leader is done, the oldest waiting caller is promoted to lead the
+    next batch, so no dedicated thread is needed.
+
+    Callers that draw connections from a pool should use submit_with, so
+    that only the leader checks one out and a batch isn't capped by the
+    pool size.
+
+    A waiting caller whose call hasn't been taken into a batch within
+    `wait_timeout` seconds withdraws it and gets GroupCommitTimeout. Once
+    a batch has taken the call it waits for that batch's outcome, so the
+    result it reports is always the real one.
+    """
+    def __init__(self, window=0.002, max_batch=64, wait_timeout=30.0):
+        if max_batch < 1:
+            raise ValueError('max_batch must be at least 1')
+        self.window = window
+        self.max_batch = max_batch
+        self.wait_timeout = wait_timeout
+        self._pending = []
+        self._leader_active = False
+        self._cond = threading.Condition()
+        self._stats = {'calls': 0, 'batches': 0, 'commits_saved': 0,
+                       'rolled_back': 0, 'timeouts': 0}
+
+    def submit(self, conn, func, *args, **kwargs):
+        """Run func(conn, *args, **kwargs) as part of the next group commit
+        and return its result (or raise its exception).
+        """
+        return self.submit_with(lambda: nullcontext(conn), func, *args, **kwargs)
+
+    def submit_with(self, connect, func, *args, **kwargs):
+        """Like submit, but `connect()` returns a context manager giving the
+        connection, and it is only entered by a caller that leads a batch.
+        Waiting callers hold no connection.
+        """
+        request = _Request(func, args, kwargs)
+        with self._cond:
+            self._stats['calls'] += 1
+            self._pending.append(request)
+            if not self._leader_active:
+                self._leader_active = True
+                request.promoted = True
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+        if not request.promoted:
+            self._wait(request)
+            if not request.promoted:
+                if request.error is not None:
+                    raise request.error
+                return request.result
+        return self._lead(connect, request)
+
+    def _wait(self, request):
+        if request.done.wait(self.wait_timeout):
+            return
+        with self._cond:
+            # Leadership is handed over and batches are taken under the
+            # lock, so the request is either still queued or already taken
+            if not request.done.is_set() and request in self._pending:
+                self._pending.remove(request)
+                self._stats['timeouts'] += 1
+                raise GroupCommitTimeout(
+                    f'not picked up by a batch within {self.wait_timeout}s')
+        request.done.wait()
+
+    def _lead(self, connect, request):
+        with self._cond:
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+
+        ran = False
+        try:
+            with connect() as conn:
+                self._run(conn, batch)
+                ran = True
+        except Exception as e:
+            if ran:
+                raise
+            # No connection for the batch: fail every call in it
+            for other in batch:
+                other.error = e
+        finally:
+            with self._cond:
+                self._stats['batches'] += 1
+                self._stats['commits_saved'] += len(batch) - 1
+                if self._pending:
+                    # Hand leadership to the oldest waiter; it leads with
+                    # its own connection.
+                    successor = self._pending[0]
+                    successor.promoted = True
+                    successor.done.set()
+                else:
+                    self._leader_active = False
+            for other in batch:
+                if other is not request:
+                    other.done.set()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self, conn, batch):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            with scope(conn):
+                for request in batch:
+                    try:
+                        with savepoint(conn, 'group_commit'):
+                            request.result = request.func(
+                                conn, *request.args, **request.kwargs)
+                    except Exception as e:
+                        request.error = e
+                        with self._cond:
+                            self._stats['rolled_back'] += 1
+            conn.commit()
+        except BaseException as e:
+            # The shared transaction itself failed: nobody's write landed
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            for request in batch:
+                if request.error is None:
+                    request.error = e
+            if not isinstance(e, Exception):
+                raise
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['pending'] = len(self._pending)
+        return snapshot
+
+
+default_committer = GroupCommitter()